@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+"""Поиск по наименованию (DescSearch) на синтетическом EVE TIN ALL: построение индекса
+и задержка на каждое нажатие клавиши при наборе запроса.
+
+    python benchmarks/bench_desc_search.py               # 300 000 строк
+    python benchmarks/bench_desc_search.py --rows 500000
+"""
+import os, sys, time, random, argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from catalog import TinIndex, DescSearch
+
+NOUNS = ["маска", "клапан", "датчик", "контур", "фильтр", "увлажнитель", "адаптер", "трубка", "мешок",
+         "катетер", "канюля", "шланг", "коннектор", "камера", "загубник"]
+ADJS = ["лицевая", "носовая", "одноразовый", "многоразовый", "детский", "взрослый", "неонатальный",
+        "дыхательный", "силиконовый", "антибактериальный", "гибкий", "гофрированный"]
+TAILS = ["размер S", "размер M", "размер L", "для ИВЛ", "с клапаном выдоха", "с портом", "стерильный",
+         "CO2", "SpO2", "Ø22 мм", "150 см", "180 см"]
+QUERIES = ["маска", "маски лицевые", "клапан выдоха", "детская маска s", "силиконовый катетер 150",
+           "увлажн", "маска арт5", "арт1234"]
+
+def synthetic_index(n: int) -> TinIndex:
+    random.seed(0)
+    tin = TinIndex()
+    for i in range(n):
+        words = [random.choice(ADJS), random.choice(NOUNS), random.choice(ADJS), random.choice(TAILS)]
+        if i % 2: words.append(f"арт{random.randrange(10 ** 5)}")   # article codes: a large vocabulary
+        tin.add(i + 1, str(100000 + i), " ".join(words), "1", 100.0, 50.0)
+    return tin
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--rows", type=int, default=300_000)
+    args = ap.parse_args()
+
+    tin = synthetic_index(args.rows)
+    t = time.perf_counter()
+    search = DescSearch(tin)
+    print(f"rows: {args.rows}, distinct descriptions: {len(search.doc_rid)}, words: {len(search.terms)}, "
+          f"build: {time.perf_counter() - t:.2f} s")
+    print(f"{'typed char by char':<28}{'avg ms':>8}{'max ms':>8}  top hit")
+    for q in QUERIES:
+        times = []
+        for k in range(1, len(q) + 1):
+            t = time.perf_counter()
+            rids = search.search(q[:k])
+            times.append((time.perf_counter() - t) * 1000)
+        top = tin.descs[rids[0]] if rids else "—"
+        print(f"{q:<28}{sum(times) / len(times):>8.2f}{max(times):>8.2f}  {top}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+"""Выгрузка КП подряд несколько раз: как было (openpyxl, load_workbook на каждую выгрузку)
+и через KpTemplate (части шаблона в памяти, лист пишется потоком) — время и пик памяти.
+
+    pip install -r benchmarks/requirements.txt   # openpyxl нужен только для замера прежнего пути
+    python benchmarks/bench_kp_export.py
+    python benchmarks/bench_kp_export.py --lines 10 50 1000 100000 --runs 20 --template path/to/template.xlsx
+
+КП длиннее строк шаблона прежний код выгрузить не мог (openpyxl падает на объединённых
+ячейках подвала), для них меряется только поток.
+"""
+import os, sys, time, argparse, tempfile, tracemalloc
+from statistics import median
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+import openpyxl
+from kp_export import FIRST_ROW, LINES_LAST, LINES_ROW, KpTemplate
+
+def make_items(n):
+    return [(f"PN-{i:05d}", f"Позиция {i}", 1 + i % 5, 10.0 + i % 500) for i in range(n)]
+
+def legacy_export(tpl_path, items, out_path):
+    """Прежний _export_kp: шаблон читается и разбирается с диска на каждую выгрузку."""
+    wb = openpyxl.load_workbook(tpl_path, keep_vba=False)
+    ws = wb.active
+    def write_line(row_index, rec):
+        pn, desc, qty, unit_price = rec
+        ws.cell(row=row_index, column=2, value=pn)
+        ws.cell(row=row_index, column=3, value=desc)
+        ws.cell(row=row_index, column=4, value=qty)
+        ws.cell(row=row_index, column=5, value=unit_price)
+        ws.cell(row=row_index, column=6, value=f"=E{row_index}*D{row_index}")
+    write_line(FIRST_ROW, items[0])
+    for i, rec in enumerate(items[1:]):
+        write_line(LINES_ROW + i, rec)
+    wb.save(out_path)
+
+def timed_runs(fn, runs):
+    times = []
+    for _ in range(runs):
+        t = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - t)
+    return times
+
+def peak_mb(fn) -> float:
+    tracemalloc.start()
+    fn()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak / 1e6
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--template", default=os.path.join(ROOT, "template.xlsx"))
+    ap.add_argument("--lines", type=int, nargs="+", default=[10, 50, 1000, 20000])
+    ap.add_argument("--runs", type=int, default=10)
+    args = ap.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        out_path = os.path.join(tmp, "КП.xlsx")
+        for n in args.lines:
+            items = make_items(n)
+            runs = args.runs if n <= 1000 else max(1, args.runs // 5)
+            print(f"{n} строк, {runs} выгрузок:")
+            if n - 1 <= LINES_LAST - LINES_ROW + 1:
+                legacy = timed_runs(lambda: legacy_export(args.template, items, out_path), runs)
+                print(f"  {'load_workbook каждый раз':<28}{median(legacy) * 1000:>9.1f} ms")
+            template = KpTemplate(args.template)
+            cached = timed_runs(lambda: template.export(items, out_path), runs)
+            print(f"  {'KpTemplate, первая':<28}{cached[0] * 1000:>9.1f} ms")
+            print(f"  {'KpTemplate, остальные':<28}{median(cached[1:] or cached) * 1000:>9.1f} ms"
+                  f"   пик памяти {peak_mb(lambda: template.export(items, out_path)):.2f} MB")
+
+if __name__ == "__main__":
+    main()
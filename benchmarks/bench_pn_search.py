@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+"""Поиск PN по мере ввода (PnSearch) на синтетическом EVE TIN ALL: время построения и ответа.
+
+    python benchmarks/bench_pn_search.py               # 200 000 строк
+    python benchmarks/bench_pn_search.py --rows 500000
+"""
+import os, sys, time, random, argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from catalog import TinIndex, PnSearch
+
+def synthetic_index(n: int) -> TinIndex:
+    random.seed(0)
+    tin = TinIndex()
+    for i in range(n):
+        ref = str(random.randrange(10 ** 5, 10 ** 7))
+        if i % 11 == 0: ref += ".0"
+        if i % 13 == 0: ref = "RT-" + ref
+        tin.add(i + 1, ref, f"Изделие {i}", "1", 100.0, 50.0)
+    return tin
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--rows", type=int, default=200_000)
+    ap.add_argument("--limit", type=int, default=50)
+    args = ap.parse_args()
+
+    tin = synthetic_index(args.rows)
+    t = time.perf_counter()
+    search = PnSearch(tin)
+    print(f"rows: {args.rows}, keys: {len(search.keys)}, trigrams: {len(search.grams)}, "
+          f"build: {time.perf_counter() - t:.2f} s")
+
+    refs = [r for r in tin.refs if r]
+    random.seed(1)
+    samples = random.sample(refs, 200)
+    queries = {
+        "prefix, typed char by char": [s[:k] for s in samples[:50] for k in range(1, len(s) + 1)],
+        "digit substring (3-5)": [s.replace("RT-", "")[2:2 + random.randint(3, 5)] for s in samples],
+        "text prefix 'rt-1'": ["rt-1"] * 50,
+        "no match": ["999999999"] * 50,
+    }
+    print(f"{'':<30}{'avg ms':>8}{'max ms':>8}{'hits':>7}")
+    for name, qs in queries.items():
+        times, hits = [], 0
+        for q in qs:
+            t = time.perf_counter()
+            hits += len(search.search(q, args.limit))
+            times.append((time.perf_counter() - t) * 1000)
+        print(f"{name:<30}{sum(times) / len(times):>8.3f}{max(times):>8.3f}{hits // len(qs):>7}")
+
+if __name__ == "__main__":
+    main()
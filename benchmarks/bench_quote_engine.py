@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+"""QuoteEngine без Qt на больших КП: загрузка строк, итоги, правки количества, смена скидки/курса,
+суммы строк и выгрузка. Для сравнения — прежний расчёт во float циклом по строкам на Python
+и его расхождение с точным итогом в копейках.
+
+    python benchmarks/bench_quote_engine.py
+    python benchmarks/bench_quote_engine.py --sizes 10000 100000 1000000 --edits 50000
+"""
+import os, sys, time, random, argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from quote import QuoteEngine, lines_from_records
+
+def make_lines(n):
+    found = {f"PN-{i:07d}": (f"Позиция {i}", "10", 10.0 + i % 500, None if i % 9 == 0 else 4.0 + i % 300)
+             for i in range(n)}
+    return lines_from_records([(pn, 1 + i % 5) for i, pn in enumerate(found)], found)
+
+def per_row_totals(lines, discount, logistics, kurs):
+    """Как считала панель до движка: float, цикл по строкам с проверкой цен."""
+    list_total = trimm_total = 0.0
+    for line in lines:
+        if line.list_price is not None:
+            list_total += line.qty * line.list_price
+        if line.trimm_price is not None:
+            trimm_total += line.qty * line.trimm_price * logistics
+    total = list_total * (1.0 - discount / 100.0) * kurs
+    trimm_total *= kurs
+    return total, (total - trimm_total) / trimm_total if trimm_total > 0 else None
+
+def timed(fn, *args):
+    t = time.perf_counter()
+    res = fn(*args)
+    return time.perf_counter() - t, res
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000])
+    ap.add_argument("--edits", type=int, default=10000, help="сколько правок количества подряд")
+    args = ap.parse_args()
+
+    rnd = random.Random(1)
+    for n in args.sizes:
+        lines = make_lines(n)
+        engine = QuoteEngine(discount=5.0, logistics=1.2, kurs=90.0)
+        print(f"{n} строк:")
+        dt, _ = timed(engine.add_lines, lines)
+        print(f"  {'add_lines':<34}{dt * 1000:>10.1f} ms")
+        dt, _ = timed(engine.recompute_sums)
+        print(f"  {'полный пересчёт итогов':<34}{dt * 1000:>10.1f} ms")
+        dt, (total, _) = timed(per_row_totals, lines, 5.0, 1.2, 90.0)
+        print(f"  {'  то же во float циклом':<34}{dt * 1000:>10.1f} ms")
+        print(f"  {'  расхождение float, коп.':<34}{total * 100 - engine.totals().total:>10.1f}")
+
+        edits = [(rnd.randrange(n), rnd.randrange(1, 50)) for _ in range(args.edits)]
+        def edit_all():
+            for row, qty in edits:
+                engine.set_qty(row, qty)
+                engine.totals()
+        dt, _ = timed(edit_all)
+        print(f"  {f'{args.edits} правок кол-ва + итоги':<34}{dt / args.edits * 1e6:>10.2f} мкс/правка")
+
+        def reprice():
+            engine.set_pricing(discount=7.5, logistics=1.3, kurs=91.25)
+            return engine.totals()
+        dt, _ = timed(reprice)
+        print(f"  {'скидка/логистика/курс + итоги':<34}{dt * 1000:>10.1f} ms")
+        dt, _ = timed(engine.line_totals)
+        print(f"  {'суммы всех строк':<34}{dt * 1000:>10.1f} ms")
+        dt, _ = timed(engine.export_rows)
+        print(f"  {'export_rows':<34}{dt * 1000:>10.1f} ms")
+        engine.check_sums()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+"""Холодный старт mag_panel: время до первого кадра окна и цена каждого импорта (-X importtime).
+
+    python benchmarks/bench_startup.py
+    python benchmarks/bench_startup.py --runs 10 --top 20
+    python benchmarks/bench_startup.py --budget 600     # код возврата 1, если первый кадр дольше 600 мс
+
+Запуски: script — обычный запуск панели (нужен дисплей), offscreen — как в дымовых тестах
+(QT_QPA_PLATFORM=offscreen). Каждый запуск — отдельный процесс; первый прогон прогревает .pyc.
+"""
+import os, sys, json, time, argparse, subprocess
+from statistics import median
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# must not be imported before the first frame: they load on connect / export
+DEFERRED = ("sqlalchemy", "psycopg", "openpyxl", "catalog_async", "catalog_addons", "kp_export")
+PHASES = ("interpreter", "import mag_panel", "QApplication", "Panel()", "first paint")
+
+def child():
+    """Запуск внутри дочернего процесса: печатает отметки времени (time.time) по этапам."""
+    marks = [time.time()]
+    import mag_panel
+    from PySide6 import QtCore, QtWidgets
+    marks.append(time.time())
+    app = QtWidgets.QApplication([sys.argv[0]])
+    marks.append(time.time())
+    w = mag_panel.Panel()
+    marks.append(time.time())
+
+    class FirstPaint(QtCore.QObject):
+        def eventFilter(self, obj, ev):
+            if ev.type() == QtCore.QEvent.Paint and len(marks) == 4:
+                marks.append(time.time())
+                QtCore.QTimer.singleShot(0, app.quit)
+            return False
+
+    first_paint = FirstPaint()
+    w.installEventFilter(first_paint)
+    w.show()
+    QtCore.QTimer.singleShot(10000, app.quit)
+    app.exec()
+    print(json.dumps({"marks": marks, "deferred": [m for m in DEFERRED if m in sys.modules],
+                      "snapshot": bool(w.catalog.snapshot_path)}))
+    sys.stdout.flush()
+    os._exit(0)   # skip Qt teardown, it is not part of startup
+
+def child_env(platform):
+    env = dict(os.environ)
+    env.pop("PYTHONDONTWRITEBYTECODE", None)   # otherwise every run recompiles the sources
+    env.pop("QT_QPA_PLATFORM", None)
+    if platform:
+        env["QT_QPA_PLATFORM"] = platform
+    return env
+
+def launch(platform):
+    started = time.time()
+    out = subprocess.run([sys.executable, os.path.abspath(__file__), "--child"], cwd=ROOT,
+                         env=child_env(platform), capture_output=True, text=True, timeout=60)
+    lines = [l for l in out.stdout.splitlines() if l.startswith("{")]
+    if out.returncode or not lines:
+        raise RuntimeError((out.stderr.strip().splitlines() or ["нет вывода"])[-1])
+    res = json.loads(lines[-1])
+    marks = [started] + res["marks"]
+    if len(marks) < len(PHASES) + 1:
+        raise RuntimeError("окно не отрисовалось за 10 с")
+    res["phases"] = [(b - a) * 1000 for a, b in zip(marks, marks[1:])]
+    return res
+
+def has_display() -> bool:
+    return sys.platform in ("win32", "darwin") or bool(os.environ.get("DISPLAY") or os.environ.get("WAYLAND_DISPLAY"))
+
+def report_launch(name, platform, runs) -> float:
+    if platform is None and not has_display():
+        print(f"{name}: пропущено — нет дисплея")
+        return 0.0
+    try:
+        launch(platform)   # warm up: .pyc, OS file cache, font cache
+        results = [launch(platform) for _ in range(runs)]
+    except Exception as e:
+        print(f"{name}: ошибка запуска: {e}")
+        return 0.0
+    print(f"{name} ({runs} запусков, медиана):")
+    for i, phase in enumerate(PHASES):
+        print(f"  {phase:<20}{median(r['phases'][i] for r in results):>9.1f} ms")
+    total = median(sum(r["phases"]) for r in results)
+    print(f"  {'до первого кадра':<20}{total:>9.1f} ms")
+    loaded = sorted({m for r in results for m in r["deferred"]})
+    print(f"  снимок каталога: {'да' if results[0]['snapshot'] else 'нет'}; "
+          f"отложенные модули загружены: {', '.join(loaded) if loaded else 'нет'}")
+    return total if not loaded else float("inf")
+
+def importtime(runs):
+    """Медиана по запускам: {модуль: (собственное время, суммарное)}, мкс, и прямые импорты mag_panel."""
+    samples, direct = {}, []
+    env = child_env(None)
+    cmd = [sys.executable, "-X", "importtime", "-c", "import mag_panel"]
+    subprocess.run(cmd, cwd=ROOT, env=env, capture_output=True)   # warm up
+    for _ in range(runs):
+        err = subprocess.run(cmd, cwd=ROOT, env=env, capture_output=True, text=True).stderr
+        children = []
+        for line in err.splitlines():
+            if not line.startswith("import time:") or "self [us]" in line:
+                continue
+            self_us, cum_us, name = line[len("import time:"):].split("|")
+            # children are printed before their parent, one indent level deeper
+            level = (len(name) - len(name.lstrip()) - 1) // 2
+            name = name.strip()
+            samples.setdefault(name, []).append((int(self_us), int(cum_us)))
+            if level == 1:
+                children.append(name)
+            elif level == 0:
+                if name == "mag_panel":
+                    direct = children
+                children = []
+    return {n: (median(s[0] for s in v), median(s[1] for s in v)) for n, v in samples.items()}, direct
+
+def report_imports(runs, top):
+    mods, direct = importtime(runs)
+    total = mods.get("mag_panel", (0, 0))[1]
+    print(f"import mag_panel (-X importtime, медиана {runs}): {total / 1000:.1f} ms")
+    print("  прямые импорты, суммарно:")
+    for name in sorted(direct, key=lambda n: -mods[n][1])[:top]:
+        print(f"    {name:<32}{mods[name][1] / 1000:>8.1f} ms")
+    packages = {}
+    for name, (self_us, _) in mods.items():
+        pkg = name.split(".")[0]
+        packages[pkg] = packages.get(pkg, 0) + self_us
+    print("  по пакетам, собственное время:")
+    for pkg, self_us in sorted(packages.items(), key=lambda kv: -kv[1])[:top]:
+        print(f"    {pkg:<32}{self_us / 1000:>8.1f} ms")
+
+def main():
+    if "--child" in sys.argv:
+        child()
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--runs", type=int, default=5)
+    ap.add_argument("--top", type=int, default=12, help="сколько самых дорогих импортов показать")
+    ap.add_argument("--budget", type=float, default=None, help="допустимое время до первого кадра offscreen, мс")
+    args = ap.parse_args()
+
+    report_imports(args.runs, args.top)
+    print()
+    report_launch("script", None, args.runs)
+    offscreen = report_launch("offscreen", "offscreen", args.runs)
+    if args.budget is not None and not (0 < offscreen <= args.budget):
+        print(f"бюджет {args.budget:.0f} ms превышен (или загружены отложенные модули)")
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
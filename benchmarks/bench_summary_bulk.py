@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+"""Массовые правки сводки на N строк: как было (QTableWidget, 8 setItem на строку), модель по
+одной операции, одной пачкой и в Panel._bulk_summary. Время включает перерисовку окна.
+
+    python benchmarks/bench_summary_bulk.py
+    python benchmarks/bench_summary_bulk.py --sizes 1000 10000 50000
+    python benchmarks/bench_summary_bulk.py --sizes 1000 10000 --legacy-max 10000   # минуты
+
+Старая сводка квадратична: перенумерация через setItem шлёт itemChanged, и каждый
+вызывает пересчёт итогов по всем строкам, поэтому по умолчанию она меряется только до 2000 строк.
+Без дисплея запускать с QT_QPA_PLATFORM=offscreen.
+"""
+import os, sys, time, argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from PySide6 import QtWidgets
+import mag_panel
+
+def make_rows(n):
+    found = {f"PN-{i:06d}": (f"Позиция {i}", "10", 10.0 + i % 500, None if i % 9 == 0 else 4.0 + i % 300)
+             for i in range(n)}
+    return [(pn, 1 + i % 5) for i, pn in enumerate(found)], found
+
+def legacy_widget(app, items, found):
+    """Прежняя сводка: QTableWidget, insertRow + 8 setItem на строку, затем перенумерация и пересчёт."""
+    table = QtWidgets.QTableWidget(0, 8)
+    table.show()
+    building = [True]   # the old _building_table: no recalc while rows go in, but _renumber ran after it
+    def recalc(*_):
+        if building[0]: return
+        return sum(int(float(table.item(r, 3).text() or "0")) * float(table.item(r, 6).text() or "0")
+                   for r in range(table.rowCount()))
+    table.itemChanged.connect(recalc)
+    for pn, qty in items:
+        desc, pack, list_price, trm = found[pn]
+        row = table.rowCount()
+        table.insertRow(row)
+        for col, text in enumerate((str(row + 1), pn, desc, str(qty), "1", pack,
+                                    mag_panel.fmt_money(list_price), mag_panel.fmt_money(trm))):
+            table.setItem(row, col, QtWidgets.QTableWidgetItem(text))
+    building[0] = False
+    for r in range(table.rowCount()):   # _renumber
+        table.setItem(r, 0, QtWidgets.QTableWidgetItem(str(r + 1)))
+    app.processEvents()
+    table.repaint()
+    table.deleteLater()
+
+def insert_per_row(p, items, found):
+    for pn, qty in items:
+        p._insert_rows([(pn, qty)], found)
+        p._recalc_totals()
+
+def insert_batch(p, items, found):
+    p._insert_rows(items, found)
+    p._recalc_totals()
+
+def delete_every_other(p, items, found):
+    # n/2 separate runs: one rowsRemoved each outside bulk mode
+    p.summaryModel.remove_rows(range(0, len(items), 2))
+    p._recalc_totals()
+
+CASES = (
+    ("добавление по одной строке", insert_per_row, False, False),
+    ("  то же в _bulk_summary", insert_per_row, True, False),
+    ("добавление одной пачкой", insert_batch, False, False),
+    ("удаление каждой 2-й строки", delete_every_other, False, True),
+    ("  то же в _bulk_summary", delete_every_other, True, True),
+)
+
+def run(app, op, bulk, prefill, items, found):
+    p = mag_panel.Panel()
+    p.show()
+    if prefill:
+        insert_batch(p, items, found)
+    app.processEvents()
+    t = time.perf_counter()
+    if bulk:
+        with p._bulk_summary():
+            op(p, items, found)
+    else:
+        op(p, items, found)
+    app.processEvents()
+    p.repaint()
+    elapsed = time.perf_counter() - t
+    p.quote.check_sums()
+    p.deleteLater()
+    app.processEvents()
+    return elapsed
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000])
+    ap.add_argument("--legacy-max", type=int, default=2000, help="QTableWidget не мерить для N больше этого")
+    args = ap.parse_args()
+
+    app = QtWidgets.QApplication.instance() or QtWidgets.QApplication([])
+    for n in args.sizes:
+        items, found = make_rows(n)
+        print(f"{n} строк:")
+        if n <= args.legacy_max:
+            t = time.perf_counter()
+            legacy_widget(app, items, found)
+            print(f"  {'QTableWidget (как было)':<32}{time.perf_counter() - t:>9.3f} s")
+        for title, op, bulk, prefill in CASES:
+            print(f"  {title:<32}{run(app, op, bulk, prefill, items, found):>9.3f} s")
+    sys.stdout.flush()
+    os._exit(0)   # skip PySide teardown of the large tables
+
+if __name__ == "__main__":
+    main()
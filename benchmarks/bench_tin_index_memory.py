@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+"""Память индекса EVE TIN ALL: прежний dict ключ -> кортеж строк против TinIndex.
+
+    python benchmarks/bench_tin_index_memory.py               # синтетика, 200 000 строк
+    python benchmarks/bench_tin_index_memory.py --rows 500000
+    python benchmarks/bench_tin_index_memory.py --url postgresql+psycopg://user:pw@host:5432/mag_config
+"""
+import os, sys, time, random, argparse, tracemalloc
+from decimal import Decimal
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from catalog import TinIndex, norm_ref, digits_only
+
+def synthetic_rows(n: int):
+    random.seed(0)
+    words = ["Маска", "лицевая", "контур", "дыхательный", "клапан", "выдоха", "датчик", "потока",
+             "одноразовый", "взрослый", "детский", "неонатальный", "фильтр", "увлажнитель", "адаптер"]
+    descs = [" ".join(random.sample(words, 4)) + f", размер {s}" for s in ("S", "M", "L", "XL") for _ in range(2000)]
+    for i in range(n):
+        ref = str(100000 + i)
+        if i % 11 == 0: ref += ".0"
+        if i % 13 == 0: ref = "RT" + ref
+        yield (i + 1, ref, random.choice(descs), random.choice(("1", "5", "10", "20", None)),
+               Decimal(random.randrange(100, 10 ** 6)) / 100, Decimal(random.randrange(100, 10 ** 6)) / 100)
+
+def db_rows(url: str):
+    from sqlalchemy import create_engine
+    from catalog import Catalog
+    cat = Catalog(create_engine(url))
+    cat.load_schema()
+    cat.detect_tin_columns()
+    from sqlalchemy import text
+    with cat.engine.connect() as conn:
+        return [tuple(r) for r in conn.execute(text(cat._tin_select()))]
+
+def build_legacy(rows):
+    # the index as it was built before TinIndex: every alias key holds its own tuple of strings
+    idx = {}
+    for _pk, ref, desc_ru, pack, price_list, price_trimm in rows:
+        if ref is None: continue
+        keys = {norm_ref(ref), str(ref).strip(), digits_only(str(ref))}
+        for k in keys:
+            idx[k] = (
+                str(desc_ru or ""),
+                None if pack is None else str(pack),
+                None if price_list is None else str(price_list),
+                None if price_trimm is None else str(price_trimm),
+            )
+    return idx
+
+def build_compact(rows):
+    idx = TinIndex()
+    for row in rows:
+        idx.add(*row)
+    return idx
+
+def measure(build, rows):
+    tracemalloc.start()
+    t = time.perf_counter()
+    obj = build(rows)
+    elapsed = time.perf_counter() - t
+    size, _peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return obj, size, elapsed
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--rows", type=int, default=200_000)
+    ap.add_argument("--url", default=None)
+    args = ap.parse_args()
+
+    rows = db_rows(args.url) if args.url else list(synthetic_rows(args.rows))
+    legacy, legacy_mem, legacy_t = measure(build_legacy, rows)
+    compact, compact_mem, compact_t = measure(build_compact, rows)
+
+    mb = 1024 * 1024
+    print(f"rows: {len(rows)}, keys: {len(legacy)} / {len(compact.keys)}, records: {len(compact)}")
+    print(f"{'':<22}{'resident MB':>12}{'build s':>10}")
+    print(f"{'before (dict->tuple)':<22}{legacy_mem / mb:>12.1f}{legacy_t:>10.2f}")
+    print(f"{'after (TinIndex)':<22}{compact_mem / mb:>12.1f}{compact_t:>10.2f}")
+    print(f"saved: {(1 - compact_mem / legacy_mem) * 100:.0f}%")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+"""Поиск позиции EVE TIN ALL по одному PN: прежний Catalog.fetch_tin (запрос собирается
+заново на каждый вызов, text() + соединение из пула SQLAlchemy) против AsyncCatalogDb.fetch_tin
+(подготовленный запрос на соединении из пула asyncio) — по одному и все сразу.
+
+    python benchmarks/bench_tin_lookup.py --url postgresql+psycopg://user:pw@host:5432/mag_config
+    python benchmarks/bench_tin_lookup.py --count 2000 --scan   # как без дополнения refindex
+
+Без --url подключение берётся из PGHOST/PGPORT/PGDATABASE/PGUSER/PGPASSWORD.
+"""
+import os, sys, time, random, argparse
+from decimal import Decimal
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from sqlalchemy import create_engine, text
+from catalog import TIN_ALL_TABLE, Catalog, TinIndex, digits_only, norm_ref, qident, ref_key_exprs
+from catalog_addons import env_url
+from catalog_async import AsyncCatalogDb
+
+def legacy_fetch(cat, pns):
+    """Catalog.fetch_tin до подготовленных запросов, как был: WHERE собирается на каждый вызов."""
+    found = TinIndex()
+    pns = [str(pn).strip().replace(",", ".") for pn in pns if pn]
+    trim_key, norm_key, digits_key = ref_key_exprs(cat.tin_ref_col)
+    if cat.tin_ref_indexed:
+        keys = set()
+        for pn in pns:
+            keys.update((pn, norm_ref(pn), digits_only(pn)))
+        keys.discard("")
+        where = (f"WHERE {trim_key} = ANY(CAST(:keys AS text[]))"
+                 f" OR {norm_key} = ANY(CAST(:keys AS text[]))"
+                 f" OR {digits_key} = ANY(CAST(:keys AS text[]))")
+        params = {"keys": sorted(keys)}
+    else:
+        nums = set()
+        for pn in pns:
+            try:
+                num = Decimal(pn)
+                if num.is_finite(): nums.add(num)
+            except Exception:
+                pass
+        ref = qident(cat.tin_ref_col)
+        where = (f"WHERE {trim_key} IN (SELECT unnest(CAST(:texts AS text[])))"
+                 f" OR {digits_key} IN (SELECT unnest(CAST(:digits AS text[])))"
+                 f" OR CASE WHEN {ref}::text ~ '^\\s*\\d+(\\.\\d+)?\\s*$'"
+                 f" THEN {trim_key}::numeric IN (SELECT unnest(CAST(:nums AS numeric[]))) END")
+        params = {"texts": sorted(set(pns)), "digits": sorted({digits_only(pn) for pn in pns} - {""}),
+                  "nums": sorted(nums)}
+    with cat.engine.connect() as conn:
+        for row in conn.execute(text(cat._tin_select(where)), params):
+            found.add(*row)
+    return found
+
+def timed(fn, pns):
+    fn(pns[:5])   # warm up: pool, plan cache, PREPARE
+    t = time.perf_counter()
+    hits = sum(1 for pn in pns if fn([pn]).find(pn))
+    return time.perf_counter() - t, hits
+
+def timed_at_once(db, cat, pns):
+    t = time.perf_counter()
+    futures = [(pn, db.submit(db.fetch_tin(cat, [pn]))) for pn in pns]
+    hits = sum(1 for pn, f in futures if f.result().find(pn))
+    return time.perf_counter() - t, hits
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--url", default=None)
+    ap.add_argument("--count", type=int, default=1000, help="сколько PN искать, по одному за вызов")
+    ap.add_argument("--scan", action="store_true", help="не использовать индексы refindex, даже если они есть")
+    args = ap.parse_args()
+
+    engine = create_engine(args.url or env_url(), pool_pre_ping=True)
+    cat = Catalog(engine)
+    cat.load_schema()
+    cat.detect_tin_columns()
+    cat.detect_ref_index()
+    if args.scan:
+        cat.tin_ref_indexed = False
+    cat.preload_all_db(only={TIN_ALL_TABLE})
+    refs = [r for r in cat.tin_index.refs if r is not None]
+    random.seed(0)
+    pns = [random.choice(refs) for _ in range(args.count)]
+
+    db = AsyncCatalogDb(engine.url.set(drivername="postgresql").render_as_string(hide_password=False))
+    try:
+        legacy_t, legacy_hits = timed(lambda p: legacy_fetch(cat, p), pns)
+        async_t, async_hits = timed(lambda p: db.submit(db.fetch_tin(cat, p)).result(), pns)
+        batch_t, batch_hits = timed_at_once(db, cat, pns)
+    finally:
+        db.close()
+
+    mode = "refindex" if cat.tin_ref_indexed else "scan"
+    print(f"EVE TIN ALL: {len(cat.tin_index)} rows, lookups: {len(pns)}, mode: {mode}")
+    print(f"{'':<30}{'ms/PN':>8}{'hits':>8}")
+    print(f"{'old fetch_tin (SQL per call)':<30}{legacy_t / len(pns) * 1000:>8.3f}{legacy_hits:>8}")
+    print(f"{'async, prepared, one by one':<30}{async_t / len(pns) * 1000:>8.3f}{async_hits:>8}")
+    print(f"{'async, prepared, all at once':<30}{batch_t / len(pns) * 1000:>8.3f}{batch_hits:>8}")
+    print(f"speedup: {legacy_t / async_t:.1f}x one by one, {legacy_t / batch_t:.1f}x all at once")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,1006 @@
+# -*- coding: utf-8 -*-
+"""Каталог MAG Config: загрузка режимов, блоков, цен EVE TIN ALL и шаблонов из PostgreSQL.
+
+Модуль не зависит от Qt — его можно вызывать из фонового потока или из пакетных скриптов.
+"""
+import re, hashlib, threading
+from array import array
+from bisect import bisect_left
+from itertools import chain
+from decimal import Decimal
+from typing import TYPE_CHECKING, Callable, Dict, Iterable, Optional, Set, Tuple, List
+
+if TYPE_CHECKING:
+    from sqlalchemy.engine import Engine
+
+LABEL_TO_TABLE = {
+    "Аппарат ИВЛ": "Block_Main",
+    "Лицензия": "License",
+    "Контуры": "Circuits",
+    "Клапаны, датчики": "Valves",
+    "Маски": "Masks",
+    "Мобильная стойка": "Mobile_Cart",
+    "Автокрепления": "Holders",
+    "Увлажнитель": "Humidifier",
+    "Датчик CO2": "CO2",
+    "Датчик SpO2": "O2",
+}
+TIN_ALL_TABLE = 'EVE TIN ALL'
+TEMPLATES_TABLE = 'Templates'
+MODES_TABLE = 'Modes'
+MODES_COL = 'Mode'
+
+ORDERED_LABELS = [
+    "Аппарат ИВЛ","Лицензия","Контуры","Клапаны, датчики",
+    "Маски","Мобильная стойка","Автокрепления","Увлажнитель",
+    "Датчик CO2","Датчик SpO2"
+]
+DEFAULT_MODES = ["EVE", "S", "F"]
+# every table the catalog is built from; each one is fingerprinted and reloaded on its own
+SOURCE_TABLES = [MODES_TABLE] + list(LABEL_TO_TABLE.values()) + [TIN_ALL_TABLE, TEMPLATES_TABLE]
+SIDES = (None, "прав", "лев")
+
+# desc, pack, list price, base TRIMM price
+TinRecord = Tuple[str, Optional[str], Optional[float], Optional[float]]
+
+def qident(name: str) -> str:
+    return '"' + name.replace('"','""') + '"'
+
+def text(sql: str):
+    # SQLAlchemy is imported on the first query: the panel starts from the snapshot without it
+    from sqlalchemy import text as sa_text
+    return sa_text(sql)
+
+INTEGRAL_REF_RE = re.compile(r"^([0-9]+)(?:\.0+)?$")
+
+def norm_ref(x) -> str:
+    """REF -> ключ: целое число теряет ведущие нули и нулевую дробь ("00123,0" -> "123"), остальное —
+    как есть. Только текстом, без float, чтобы длинные номера не округлялись: по тем же правилам
+    считает mag_norm_ref в БД (catalog_addons.py, проверка — `catalog_addons.py check refindex`)."""
+    if x is None: return ""
+    s = str(x).strip().replace(",", ".")
+    m = INTEGRAL_REF_RE.match(s)
+    return (m.group(1).lstrip("0") or "0") if m else s
+
+def digits_only(s: str) -> str:
+    return re.sub(r"\D", "", s or "")
+
+def find_column(cols: List[str], col_names: List[str]) -> Optional[str]:
+    s = {n.lower(): n for n in cols}
+    for name in col_names:
+        if name.lower() in s: return s[name.lower()]
+    wanted = {n.lower().replace(" ", "") for n in col_names}
+    for c in cols:
+        if c.lower().replace(" ", "") in wanted:
+            return c
+    return None
+
+class SchemaMap:
+    """Столбцы и типы всех таблиц текущей схемы, в порядке ordinal_position."""
+    def __init__(self, tables: Optional[Dict[str, List[Tuple[str, str]]]] = None, fingerprint: str = "",
+                 primary_keys: Optional[Dict[str, List[str]]] = None):
+        self.tables: Dict[str, List[Tuple[str, str]]] = tables or {}
+        self.primary_keys: Dict[str, List[str]] = primary_keys or {}
+        self.fingerprint = fingerprint
+
+    def has_table(self, table: str) -> bool:
+        return table in self.tables
+
+    def columns(self, table: str) -> List[str]:
+        return [name for name, _ in self.tables.get(table, [])]
+
+    def types(self, table: str) -> Dict[str, str]:
+        return dict(self.tables.get(table, []))
+
+    def has_columns(self, table: str, cols: List[str]) -> Dict[str, bool]:
+        existing = set(self.columns(table))
+        return {c: (c in existing) for c in cols}
+
+    def primary_key(self, table: str) -> Optional[str]:
+        """Столбец первичного ключа, если ключ состоит из одного столбца."""
+        pk = self.primary_keys.get(table) or []
+        return pk[0] if len(pk) == 1 else None
+
+    def signature(self, table: str) -> str:
+        cols = ",".join(f"{n}:{t}" for n, t in self.tables.get(table, []))
+        return hashlib.md5(cols.encode("utf-8")).hexdigest()[:12]
+
+# pg_attribute/pg_class rows get a new xmin on any DDL touching the table,
+# so this one-row digest changes whenever a column is added, dropped, renamed or retyped
+SCHEMA_FINGERPRINT_SQL = """
+    SELECT md5(coalesce(string_agg(
+               c.oid::text || ':' || c.xmin::text || ':' || a.attnum::text || ':' || a.xmin::text,
+               ',' ORDER BY c.oid, a.attnum), ''))
+    FROM pg_class c
+    JOIN pg_attribute a ON a.attrelid = c.oid AND a.attnum > 0
+    WHERE c.relnamespace = current_schema()::regnamespace
+      AND c.relkind IN ('r', 'v', 'm', 'p', 'f')
+"""
+SCHEMA_COLUMNS_SQL = """
+    SELECT c.table_name, c.column_name, c.data_type, pk.attname IS NOT NULL AS is_pk
+    FROM information_schema.columns c
+    LEFT JOIN (
+        SELECT cl.relname, a.attname
+        FROM pg_index i
+        JOIN pg_class cl ON cl.oid = i.indrelid
+        JOIN pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = ANY(i.indkey)
+        WHERE i.indisprimary AND cl.relnamespace = current_schema()::regnamespace
+    ) pk ON pk.relname = c.table_name AND pk.attname = c.column_name
+    WHERE c.table_schema = current_schema()
+    ORDER BY c.table_name, c.ordinal_position
+"""
+
+# optional add-on (catalog_addons.py install refindex): expression indexes over the REF lookup keys
+REF_NORM_FUNCTION = "mag_norm_ref"
+REF_INDEXES = ("mag_tin_ref_trim", "mag_tin_ref_norm", "mag_tin_ref_digits")
+REF_INDEX_SQL = """
+    SELECT count(*)
+    FROM pg_index i
+    JOIN pg_class t ON t.oid = i.indrelid
+    JOIN pg_class ix ON ix.oid = i.indexrelid
+    WHERE t.relnamespace = current_schema()::regnamespace AND t.relname = :table
+      AND ix.relname = ANY(:names) AND i.indisvalid
+"""
+
+def ref_key_exprs(ref_col: str) -> Tuple[str, str, str]:
+    """SQL-выражения ключей REF (как есть, norm_ref, digits_only) — одни и те же в индексах и в запросах."""
+    r = f"{qident(ref_col)}::text"
+    return (f"trim({r})", f"{REF_NORM_FUNCTION}({r})", f"regexp_replace({r}, '\\D', '', 'g')")
+
+_schema_cache: Dict[str, SchemaMap] = {}
+
+def load_schema(conn) -> SchemaMap:
+    fingerprint = conn.execute(text(SCHEMA_FINGERPRINT_SQL)).scalar() or ""
+    cached = _schema_cache.get(fingerprint)
+    if cached is not None:
+        return cached
+    tables: Dict[str, List[Tuple[str, str]]] = {}
+    primary_keys: Dict[str, List[str]] = {}
+    for tname, cname, ctype, is_pk in conn.execute(text(SCHEMA_COLUMNS_SQL)):
+        tables.setdefault(tname, []).append((cname, ctype))
+        if is_pk:
+            primary_keys.setdefault(tname, []).append(cname)
+    schema = SchemaMap(tables, fingerprint, primary_keys)
+    _schema_cache[fingerprint] = schema
+    return schema
+
+def fetch_fingerprints(conn, schema: SchemaMap, tables: Iterable[str]) -> Dict[str, Optional[str]]:
+    """Дешёвый отпечаток содержимого таблиц: число строк, max(xmin) и набор столбцов.
+
+    INSERT/UPDATE дают новый xmin, DELETE меняет число строк. Отсутствующая таблица
+    получает постоянный отпечаток "-", таблица, которую не удалось прочитать, — None.
+    """
+    tables = list(tables)
+    result: Dict[str, Optional[str]] = {t: "-" for t in tables if not schema.has_table(t)}
+    selects = {i: f'SELECT {i}, count(*), max(xmin::text::bigint) FROM {qident(t)}'
+               for i, t in enumerate(tables) if schema.has_table(t)}
+    if not selects:
+        return result
+
+    def fp(i, n, x):
+        return f"{n}:{x}:{schema.signature(tables[i])}"
+
+    try:
+        for i, n, x in conn.execute(text("\nUNION ALL\n".join(selects.values()))):
+            result[tables[i]] = fp(i, n, x)
+        return result
+    except Exception:
+        conn.rollback()
+    for i, sel in selects.items():
+        try:
+            _, n, x = conn.execute(text(sel)).one()
+            result[tables[i]] = fp(i, n, x)
+        except Exception:
+            conn.rollback()
+            result[tables[i]] = None
+    return result
+
+# 32-bit xid of the oldest transaction still in progress, comparable with xmin::text::bigint
+SYNC_HORIZON_SQL = "SELECT txid_snapshot_xmin(txid_current_snapshot()) % 4294967296"
+
+def parse_fingerprint(fp: Optional[str]) -> Optional[Tuple[int, int, str]]:
+    try:
+        n, x, sig = fp.split(":")
+        return int(n), int(x) if x != "None" else 0, sig
+    except Exception:
+        return None
+
+def pk_key(value):
+    return value if isinstance(value, (int, str)) else str(value)
+
+def parse_money(s) -> Optional[float]:
+    if s is None: return None
+    t = str(s).strip().replace(",", ".")
+    try:
+        f = float(t)
+    except Exception:
+        return None
+    return None if f != f else f
+
+def alias_keys(ref: str) -> Set[str]:
+    """Ключи, по которым ищется позиция: как в БД, нормализованный REF и только цифры."""
+    keys = {norm_ref(ref), ref.strip(), digits_only(ref)}
+    keys.discard("")
+    return keys
+
+NO_PRICE = float("nan")
+
+class TinIndex:
+    """Компактный индекс EVE TIN ALL.
+
+    Записи лежат по столбцам (цены — array('d') с NaN вместо NULL, разобраны один раз),
+    все ключи-синонимы REF указывают на номер записи, описания и упаковки интернированы.
+    Ключ, общий для нескольких записей, указывает на последнюю добавленную; остальные ждут
+    в shadowed и получают ключ обратно, когда её удаляют.
+    """
+    __slots__ = ("refs", "descs", "packs", "list_prices", "trimm_prices", "keys", "shadowed", "by_pk", "free",
+                 "_strings")
+
+    def __init__(self):
+        self.refs: List[Optional[str]] = []   # None — запись удалена, номер в free
+        self.descs: List[str] = []
+        self.packs: List[Optional[str]] = []
+        self.list_prices = array("d")
+        self.trimm_prices = array("d")
+        self.keys: Dict[str, int] = {}
+        self.shadowed: Dict[str, List[int]] = {}   # key -> earlier rows with that key, hidden by keys[key]
+        self.by_pk: Dict[object, int] = {}
+        self.free: List[int] = []
+        self._strings: Dict[str, str] = {}
+
+    def __len__(self) -> int:
+        return len(self.refs) - len(self.free)
+
+    def copy(self) -> "TinIndex":
+        other = TinIndex()
+        other.refs, other.descs, other.packs = self.refs[:], self.descs[:], self.packs[:]
+        other.list_prices, other.trimm_prices = array("d", self.list_prices), array("d", self.trimm_prices)
+        other.keys, other.by_pk, other.free = dict(self.keys), dict(self.by_pk), self.free[:]
+        other.shadowed = {k: rids[:] for k, rids in self.shadowed.items()}
+        other._strings = self._strings
+        return other
+
+    def _intern(self, s: Optional[str]) -> Optional[str]:
+        if s is None: return None
+        return self._strings.setdefault(s, s)
+
+    def add(self, pk, ref, desc, pack, price_list, price_trimm):
+        if ref is None: return
+        ref = str(ref)
+        pk = None if pk is None else pk_key(pk)
+        rid = self.by_pk.get(pk) if pk is not None else None
+        if rid is not None:
+            self._unlink(rid)
+        elif self.free:
+            rid = self.free.pop()
+        else:
+            rid = len(self.refs)
+            self.refs.append(None); self.descs.append(""); self.packs.append(None)
+            self.list_prices.append(NO_PRICE); self.trimm_prices.append(NO_PRICE)
+
+        lp, tp = parse_money(price_list), parse_money(price_trimm)
+        self.refs[rid] = ref
+        self.descs[rid] = self._intern(str(desc or ""))
+        self.packs[rid] = self._intern(None if pack is None else str(pack))
+        self.list_prices[rid] = NO_PRICE if lp is None else lp
+        self.trimm_prices[rid] = NO_PRICE if tp is None else tp
+        for k in alias_keys(ref):
+            prev = self.keys.get(k)
+            if prev is not None and prev != rid:
+                self.shadowed.setdefault(k, []).append(prev)
+            self.keys[k] = rid
+        if pk is not None:
+            self.by_pk[pk] = rid
+
+    def remove(self, pk):
+        rid = self.by_pk.pop(pk_key(pk), None)
+        if rid is None: return
+        self._unlink(rid)
+        self.refs[rid] = None
+        self.free.append(rid)
+
+    def _unlink(self, rid: int):
+        for k in alias_keys(self.refs[rid]):
+            others = self.shadowed.get(k)
+            if self.keys.get(k) != rid:
+                # another row holds the key: only forget that this one had it too
+                if others and rid in others:
+                    others.remove(rid)
+                    if not others: del self.shadowed[k]
+                continue
+            # the key goes back to the row it hid, if that row still has it
+            while others:
+                prev = others.pop()
+                if prev != rid and self.refs[prev] is not None and k in alias_keys(self.refs[prev]):
+                    self.keys[k] = prev
+                    break
+            else:
+                del self.keys[k]
+            if others is not None and not others:
+                del self.shadowed[k]
+
+    def lookup(self, pn: str) -> Optional[int]:
+        for k in (pn, norm_ref(pn), digits_only(pn)):
+            rid = self.keys.get(k)
+            if rid is not None:
+                return rid
+        return None
+
+    def record(self, rid: int) -> TinRecord:
+        lp, tp = self.list_prices[rid], self.trimm_prices[rid]
+        return (self.descs[rid], self.packs[rid], None if lp != lp else lp, None if tp != tp else tp)
+
+    def find(self, pn: str) -> Optional[TinRecord]:
+        rid = self.lookup(pn) if pn else None
+        return None if rid is None else self.record(rid)
+
+    def dump(self):
+        return (self.refs, self.descs, self.packs, self.list_prices.tobytes(), self.trimm_prices.tobytes(),
+                self.keys, self.shadowed, self.by_pk, self.free)
+
+    @classmethod
+    def load(cls, data) -> "TinIndex":
+        idx = cls()
+        idx.refs, idx.descs, idx.packs, lp, tp, idx.keys, idx.shadowed, idx.by_pk, idx.free = data
+        idx.list_prices.frombytes(lp)
+        idx.trimm_prices.frombytes(tp)
+        idx._strings = {s: s for s in idx.descs}
+        idx._strings.update((s, s) for s in idx.packs if s is not None)
+        return idx
+
+class PnSearch:
+    """Поиск PN по мере ввода: префикс — бинарным поиском по отсортированным ключам
+    (REF в нижнем регистре и только цифры), подстрока — по триграммам цифровых ключей.
+    Строится по конкретному TinIndex и отвечает номерами его записей."""
+    __slots__ = ("tin", "keys", "rids", "grams")
+
+    def __init__(self, tin: TinIndex):
+        self.tin = tin
+        pairs: List[Tuple[str, int]] = []
+        grams: Dict[str, array] = {}
+        for rid, ref in enumerate(tin.refs):
+            if ref is None: continue
+            text_key = ref.strip().casefold()
+            digits = digits_only(ref)
+            pairs.append((text_key, rid))
+            if digits and digits != text_key:
+                pairs.append((digits, rid))
+            for g in {digits[i:i + 3] for i in range(len(digits) - 2)}:
+                posting = grams.get(g)
+                if posting is None:
+                    posting = grams[g] = array("i")
+                posting.append(rid)
+        pairs.sort()
+        self.keys = [k for k, _ in pairs]
+        self.rids = array("i", [rid for _, rid in pairs])
+        self.grams = grams
+
+    def search(self, query: str, limit: int = 50) -> List[int]:
+        q = query.strip().casefold()
+        digits = digits_only(q)
+        found: Dict[int, None] = {}   # ordered set: prefix hits first, then substrings
+        for prefix in dict.fromkeys((q, digits)):
+            if not prefix: continue
+            i = bisect_left(self.keys, prefix)
+            while i < len(self.keys) and len(found) < limit and self.keys[i].startswith(prefix):
+                found[self.rids[i]] = None
+                i += 1
+        if len(found) < limit and len(digits) >= 3:
+            postings = [self.grams.get(digits[i:i + 3]) for i in range(len(digits) - 2)]
+            if all(postings):
+                refs = self.tin.refs
+                shortest = min(postings, key=len)
+                for rid in shortest:
+                    ref = refs[rid]
+                    if rid in found or ref is None:
+                        continue
+                    if len(digits) == 3 or digits in ref or (not ref.isdigit() and digits in digits_only(ref)):
+                        found[rid] = None
+                        if len(found) >= limit: break
+        return list(found)
+
+WORD_RE = re.compile(r"\w+")
+# light Russian stemming: drop one inflectional ending, keep at least 3 letters of the stem
+RU_ENDINGS = sorted((
+    "иями", "ами", "ями", "ими", "ыми", "его", "ого", "ему", "ому", "иях", "иям",
+    "ах", "ях", "ам", "ям", "ов", "ев", "ом", "ем", "ей", "ой", "ий", "ый", "ая", "яя",
+    "ое", "ее", "ые", "ие", "ых", "их", "ую", "юю", "ия", "ию", "ии", "ья", "ье", "ьи", "ью",
+    "а", "я", "о", "е", "ы", "и", "у", "ю", "ь", "й",
+), key=len, reverse=True)
+
+def fold_text(s: str) -> str:
+    return s.casefold().replace("ё", "е")
+
+def ru_stem(word: str) -> str:
+    if not ("а" <= word[-1:] <= "я"):
+        return word   # latin, digits, "co2" and the like stay as they are
+    for end in RU_ENDINGS:
+        if word.endswith(end) and len(word) - len(end) >= 3:
+            return word[:-len(end)]
+    return word
+
+SEARCH_REFINE_LIMIT = 1000   # answers up to this size are kept for filtering on the next keystroke
+
+class DescSearch:
+    """Полнотекстовый поиск по наименованиям EVE TIN ALL: инвертированный индекс в памяти.
+
+    Одинаковые описания (в TinIndex они интернированы) индексируются один раз, номера
+    документов идут от коротких описаний к длинным. Все слова запроса обязательны,
+    последнее — если после него нет пробела — ищется как начало слова. Порядок выдачи:
+    сначала совпадение последнего слова целиком, внутри — более короткие описания.
+    Уточнение запроса по мере ввода фильтрует прошлый полный ответ, не трогая индекс.
+    """
+    __slots__ = ("tin", "doc_rid", "doc_more", "terms", "postings", "doc_terms", "doc_start", "_last", "_wide")
+
+    def __init__(self, tin: TinIndex):
+        self.tin = tin
+        by_desc: Dict[str, List[int]] = {}
+        for rid, ref in enumerate(tin.refs):
+            if ref is not None and tin.descs[rid]:
+                by_desc.setdefault(tin.descs[rid], []).append(rid)
+        stem_cache: Dict[str, str] = {}
+        docs = []
+        for desc, rids in by_desc.items():
+            stems = []
+            for w in WORD_RE.findall(fold_text(desc)):
+                st = stem_cache.get(w)
+                if st is None:
+                    st = stem_cache[w] = ru_stem(w)
+                stems.append(st)
+            docs.append((len(stems), len(desc), stems, rids))
+        docs.sort(key=lambda d: (d[0], d[1]))
+
+        self.terms = sorted({st for d in docs for st in d[2]})
+        term_id = {t: i for i, t in enumerate(self.terms)}
+        self.postings = [array("i") for _ in self.terms]
+        self.doc_rid = array("i")
+        self.doc_more: Dict[int, List[int]] = {}
+        self.doc_terms = array("i")
+        self.doc_start = array("i", [0])
+        for doc, (_, _, stems, rids) in enumerate(docs):
+            self.doc_rid.append(rids[0])
+            if len(rids) > 1:
+                self.doc_more[doc] = rids[1:]
+            for tid in sorted({term_id[st] for st in stems}):
+                self.postings[tid].append(doc)
+                self.doc_terms.append(tid)
+            self.doc_start.append(len(self.doc_terms))
+        self._last: Optional[Tuple[List[Tuple[int, int]], List[int]]] = None
+        self._wide: Dict[Tuple[int, int], Set[int]] = {}
+
+    def _range(self, stem: str, prefix: bool) -> Tuple[int, int]:
+        lo = bisect_left(self.terms, stem)
+        if not prefix:
+            return (lo, lo + 1) if lo < len(self.terms) and self.terms[lo] == stem else (lo, lo)
+        hi = bisect_left(self.terms, stem + "\U0010ffff", lo)
+        return lo, hi
+
+    def _has(self, doc: int, rng: Tuple[int, int]) -> bool:
+        lo, hi = rng
+        return any(lo <= t < hi for t in self.doc_terms[self.doc_start[doc]:self.doc_start[doc + 1]])
+
+    def _union(self, lo: int, hi: int) -> Set[int]:
+        if hi - lo <= 256:
+            return set(chain.from_iterable(self.postings[lo:hi]))
+        # the first letters typed span thousands of words; they come back with every new query
+        docs = self._wide.get((lo, hi))
+        if docs is None:
+            if len(self._wide) >= 32: self._wide.clear()
+            docs = self._wide[(lo, hi)] = set(chain.from_iterable(self.postings[lo:hi]))
+        return docs
+
+    def _docs(self, ranges: List[Tuple[int, int]], limit: int) -> List[int]:
+        # set intersection and sort run in C; doc order = shorter descriptions first
+        sets = sorted((self._union(lo, hi) for lo, hi in ranges), key=len)
+        return sorted(sets[0].intersection(*sets[1:]))[:limit]
+
+    def search(self, query: str, limit: int = 50) -> List[int]:
+        words = WORD_RE.findall(fold_text(query))
+        if not words:
+            return []
+        typing = query[-1:].isalnum()
+        ranges = [self._range(ru_stem(w), typing and i == len(words) - 1) for i, w in enumerate(words)]
+        if any(lo >= hi for lo, hi in ranges):
+            return []
+
+        last = self._last
+        if last is not None and len(ranges) >= len(last[0]) and all(
+                olo <= lo and hi <= ohi for (olo, ohi), (lo, hi) in zip(last[0], ranges)):
+            # refinement of a query whose full answer we already have: filter it
+            docs = [d for d in last[1] if all(self._has(d, r) for r in ranges)]
+        else:
+            docs = self._docs(ranges, SEARCH_REFINE_LIMIT + 1)
+        self._last = (ranges, docs) if len(docs) <= SEARCH_REFINE_LIMIT else None
+
+        if typing:
+            # whole-word hits for the word being typed go first
+            exact = self._range(ru_stem(words[-1]), False)
+            if exact[0] < exact[1] and exact != ranges[-1]:
+                if self._last is not None:
+                    whole = [d for d in docs if self._has(d, exact)]
+                else:
+                    whole = self._docs(ranges[:-1] + [exact], limit)
+                seen = set(whole)
+                docs = whole + [d for d in docs if d not in seen]
+
+        rids: List[int] = []
+        for doc in docs:
+            rids.append(self.doc_rid[doc])
+            rids.extend(self.doc_more.get(doc, ()))
+            if len(rids) >= limit: break
+        return rids[:limit]
+
+class LoadCancelled(Exception):
+    """Загрузка каталога прервана (например, пользователь переподключился)."""
+
+class Catalog:
+    """Данные каталога одного подключения.
+
+    Каждый этап собирает свои структуры локально и публикует их одним присваиванием,
+    поэтому GUI-поток может читать уже готовые части, пока фоновый поток грузит остальные.
+    """
+    def __init__(self, engine: Optional["Engine"] = None):
+        self.engine = engine
+        self.schema = SchemaMap()
+
+        self.available_modes: List[str] = DEFAULT_MODES[:]
+        self.table_cache: Dict[str, List[Dict[str,str]]] = {}
+        self.options_cache: Dict[Tuple[str, str, Optional[str]], Dict[str, str]] = {}
+        self.tin_index = TinIndex()
+        self.pn_search: Optional[PnSearch] = None
+        self.desc_search: Optional[DescSearch] = None
+
+        self.tin_pk_col = None
+        self.tin_ref_col = None
+        self.tin_desc_col = None
+        self.tin_pack_col = None
+        self.tin_price_list_col = None
+        self.tin_price_trimm_col = None
+        self.tin_ref_indexed = False
+
+        self.templates: Dict[str, List[Tuple[str, int]]] = {}
+        self.templates_error: Optional[str] = None
+
+        # source table -> fingerprint of the data currently held (see fetch_fingerprints)
+        self.fingerprints: Dict[str, str] = {}
+        self._pending_fingerprints: Dict[str, Optional[str]] = {}
+        self.last_changed: Set[str] = set()
+        # oldest transaction still running at the last sync: rows with xmin >= this may be new to us
+        self.sync_horizon: Optional[int] = None
+        self._pending_horizon: Optional[int] = None
+        self.snapshot_path: Optional[str] = None
+        self.snapshot_time: Optional[float] = None
+
+        self._cancel = threading.Event()
+
+    def copy_from(self, other: "Catalog"):
+        """Взять уже загруженные данные другого каталога той же БД как отправную точку синхронизации."""
+        self.available_modes = other.available_modes
+        self.table_cache = other.table_cache
+        self.options_cache = other.options_cache
+        self.tin_index = other.tin_index
+        self.pn_search = other.pn_search
+        self.desc_search = other.desc_search
+        self.tin_pk_col = other.tin_pk_col
+        self.tin_ref_col = other.tin_ref_col
+        self.tin_desc_col = other.tin_desc_col
+        self.tin_pack_col = other.tin_pack_col
+        self.tin_price_list_col = other.tin_price_list_col
+        self.tin_price_trimm_col = other.tin_price_trimm_col
+        self.tin_ref_indexed = other.tin_ref_indexed
+        self.templates = other.templates
+        self.fingerprints = dict(other.fingerprints)
+        self.sync_horizon = other.sync_horizon
+        self.snapshot_path = other.snapshot_path
+        self.snapshot_time = other.snapshot_time
+
+    def cancel(self):
+        self._cancel.set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancel.is_set()
+
+    def _check_cancel(self):
+        if self._cancel.is_set():
+            raise LoadCancelled()
+
+    # ============== Schema ==============
+    def load_schema(self):
+        if self.engine is None:
+            self.schema = SchemaMap()
+            return
+        with self.engine.connect() as conn:
+            self.schema = load_schema(conn)
+
+    # ============== Change detection ==============
+    def changed_sources(self, tables: Optional[Iterable[str]] = None) -> Set[str]:
+        """Источники, данные которых отличаются от уже загруженных (все — если загружено ничего).
+
+        С tables проверяются только эти таблицы; отпечатки остальных остаются прежними.
+        """
+        if self.engine is None:
+            return set()
+        tables = SOURCE_TABLES if tables is None else [t for t in SOURCE_TABLES if t in set(tables)]
+        with self.engine.connect() as conn:
+            horizon = conn.execute(text(SYNC_HORIZON_SQL)).scalar()
+            current = fetch_fingerprints(conn, self.schema, tables)
+        # the horizon only matters for the EVE TIN ALL delta, so it may only move when that table was checked
+        self._pending_horizon = horizon if TIN_ALL_TABLE in tables else self.sync_horizon
+        self._pending_fingerprints = {**self.fingerprints, **current}
+        self.last_changed = {t for t in tables if current.get(t) is None or current[t] != self.fingerprints.get(t)}
+        return self.last_changed
+
+    def commit_fingerprints(self):
+        fingerprints = {t: fp for t, fp in self._pending_fingerprints.items() if fp is not None}
+        if self.templates_error:
+            fingerprints.pop(TEMPLATES_TABLE, None)
+        self.fingerprints = fingerprints
+        self.sync_horizon = self._pending_horizon
+
+    # ============== Modes ==============
+    def load_modes(self):
+        self.available_modes = DEFAULT_MODES[:]
+        if self.engine is None:
+            return
+        try:
+            cols = self.schema.columns(MODES_TABLE)
+            if not cols:
+                return
+            mode_col = find_column(cols, [MODES_COL])
+            if not mode_col:
+                return
+            sql = f'''
+                SELECT DISTINCT {qident(mode_col)} AS mode
+                FROM {qident(MODES_TABLE)}
+                WHERE {qident(mode_col)} IS NOT NULL AND trim({qident(mode_col)}::text) <> ''
+                ORDER BY {qident(mode_col)}
+            '''
+            modes: List[str] = []
+            with self.engine.connect() as conn:
+                for (m,) in conn.execute(text(sql)):
+                    s = str(m).strip()
+                    if s and s not in modes:
+                        modes.append(s)
+            if modes:
+                self.available_modes = modes
+        except Exception:
+            pass
+
+    # ============== EVE TIN ALL columns ==============
+    def detect_tin_columns(self):
+        self.tin_pk_col = None
+        self.tin_ref_col = None
+        self.tin_desc_col = None
+        self.tin_pack_col = None
+        self.tin_price_list_col = None
+        self.tin_price_trimm_col = None
+
+        if not self.schema.has_table(TIN_ALL_TABLE):
+            raise LookupError(f'Таблица "{TIN_ALL_TABLE}" не найдена.')
+        cols = self.schema.columns(TIN_ALL_TABLE)
+        self.tin_pk_col = self.schema.primary_key(TIN_ALL_TABLE)
+
+        def norm(s): return (s or "").lower().replace(" ", "")
+
+        candidates = ["ref#","ref #","ref","pn","кат. №","кат.#","артикул"]
+        for c in cols:
+            n = norm(c)
+            if n in {x.replace(" ","") for x in candidates} or "ref" in n:
+                self.tin_ref_col = c; break
+        if not self.tin_ref_col and cols: self.tin_ref_col = cols[0]
+
+        for c in cols:
+            if norm(c) in ("наименованиерус","наименование","описание","описаное"):
+                self.tin_desc_col = c; break
+        if not self.tin_desc_col and len(cols)>1: self.tin_desc_col = cols[1] if len(cols)>1 else cols[0]
+
+        for c in cols:
+            if norm(c) in ("вуп-ке","вуп","упаковка","шт/уп"):
+                self.tin_pack_col = c; break
+
+        for c in cols:
+            nc = norm(c)
+            if self.tin_price_list_col is None and ("лист" in nc and "25" in nc):
+                self.tin_price_list_col = c
+            if self.tin_price_trimm_col is None and (("трм" in nc or "трим" in nc or "трмм" in nc) and "25" in nc):
+                self.tin_price_trimm_col = c
+        if self.tin_price_trimm_col:
+            candidates_trm = [c for c in cols if ("трм" in norm(c) or "трим" in norm(c) or "трмм" in norm(c)) and "25" in norm(c)]
+            for c in candidates_trm:
+                if "спец" in norm(c):
+                    self.tin_price_trimm_col = c
+                    break
+
+    def detect_ref_index(self):
+        """Есть ли индексы дополнения refindex — тогда поиск по PN (tin_lookup_sql) идёт по ним, а не перебором."""
+        self.tin_ref_indexed = False
+        if self.engine is None:
+            return
+        with self.engine.connect() as conn:
+            n = conn.execute(text(REF_INDEX_SQL), {"table": TIN_ALL_TABLE, "names": list(REF_INDEXES)}).scalar()
+        self.tin_ref_indexed = n == len(REF_INDEXES)
+
+    def tin_lookup_sql(self, paramstyle: str = "named") -> str:
+        """Запрос строк EVE TIN ALL по списку PN. Текст зависит только от найденных столбцов
+        и наличия refindex, PN передаются параметрами (см. tin_lookup_params).
+        paramstyle: "named" — :name для text(), "pyformat" — %(name)s для psycopg."""
+        ph = (lambda n: f":{n}") if paramstyle == "named" else (lambda n: f"%({n})s")
+        trim_key, norm_key, digits_key = ref_key_exprs(self.tin_ref_col)
+        if self.tin_ref_indexed:
+            # plain equality on the indexed expressions: a few index probes per PN
+            keys = f"ANY(CAST({ph('keys')} AS text[]))"
+            where = f"WHERE {trim_key} = {keys} OR {norm_key} = {keys} OR {digits_key} = {keys}"
+        else:
+            # IN (SELECT unnest(...)) is hashed once, = ANY(:param) would rescan the array per row;
+            # CASE keeps the ::numeric cast away from non-numeric REF values
+            ref = qident(self.tin_ref_col)
+            where = (f"WHERE {trim_key} IN (SELECT unnest(CAST({ph('texts')} AS text[])))"
+                     f" OR {digits_key} IN (SELECT unnest(CAST({ph('digits')} AS text[])))"
+                     f" OR CASE WHEN {ref}::text ~ '^\\s*\\d+(\\.\\d+)?\\s*$'"
+                     f" THEN {trim_key}::numeric IN (SELECT unnest(CAST({ph('nums')} AS numeric[]))) END")
+        select = self._tin_select()
+        if paramstyle != "named":
+            select = select.replace("%", "%%")
+        return select + where
+
+    def tin_lookup_params(self, pns: Iterable[str]) -> Dict[str, list]:
+        pns = sorted({str(pn).strip().replace(",", ".") for pn in pns if pn})
+        if self.tin_ref_indexed:
+            keys = set()
+            for pn in pns:
+                keys.update((pn, norm_ref(pn), digits_only(pn)))
+            keys.discard("")
+            return {"keys": sorted(keys)}
+        nums = set()
+        for pn in pns:
+            try:
+                num = Decimal(pn)
+                if num.is_finite(): nums.add(num)
+            except Exception:
+                pass
+        return {"texts": pns, "digits": sorted({digits_only(pn) for pn in pns} - {""}), "nums": sorted(nums)}
+
+    def ensure_pn_search(self) -> PnSearch:
+        if self.pn_search is None or self.pn_search.tin is not self.tin_index:
+            self.pn_search = PnSearch(self.tin_index)
+        return self.pn_search
+
+    def ensure_desc_search(self) -> DescSearch:
+        if self.desc_search is None or self.desc_search.tin is not self.tin_index:
+            self.desc_search = DescSearch(self.tin_index)
+        return self.desc_search
+
+    def search_indexes_ready(self) -> bool:
+        return all(x is not None and x.tin is self.tin_index for x in (self.pn_search, self.desc_search))
+
+    def ensure_search_indexes(self):
+        self.ensure_pn_search()
+        self.ensure_desc_search()
+
+    def search_desc(self, query: str, limit: int = 50, build: bool = True) -> List[Tuple[str, TinRecord]]:
+        """Позиции EVE TIN ALL по словам наименования: [(REF, запись)], лучшие первыми.
+        build=False — не строить индекс заново, искать по прежнему (если он есть)."""
+        search = self.ensure_desc_search() if build else self.desc_search
+        if search is None:
+            return []
+        tin = search.tin
+        return [(tin.refs[rid], tin.record(rid)) for rid in search.search(query, limit)]
+
+    def search_pn(self, query: str, limit: int = 50, build: bool = True) -> List[Tuple[str, TinRecord]]:
+        """Позиции EVE TIN ALL, чей REF начинается с query или содержит его цифры: [(REF, запись)]."""
+        search = self.ensure_pn_search() if build else self.pn_search
+        if search is None:
+            return []
+        tin = search.tin
+        return [(tin.refs[rid], tin.record(rid)) for rid in search.search(query, limit)]
+
+    # ============== Blocks & prices ==============
+    def preload_all_db(self, progress: Optional[Callable[[int, int, str], None]] = None,
+                       only: Optional[Set[str]] = None):
+        """Загрузить блоки и EVE TIN ALL; с only — перечитать только эти таблицы, остальное оставить."""
+        blocks = [t for t in LABEL_TO_TABLE.values() if only is None or t in only]
+        load_tin = only is None or TIN_ALL_TABLE in only
+        table_cache: Dict[str, List[Dict[str,str]]] = {} if only is None else dict(self.table_cache)
+        options_cache: Dict[Tuple[str, str, Optional[str]], Dict[str, str]] = {}
+        if self.engine is None:
+            self.table_cache, self.options_cache, self.tin_index = table_cache, options_cache, TinIndex()
+            return
+        total = 2
+        with self.engine.connect() as conn:
+            self._check_cancel()
+            if progress: progress(1, total, "блоки")
+            if blocks:
+                table_cache.update(fetch_block_tables(conn, blocks, self.schema))
+            if only is not None and MODES_TABLE not in only:
+                # modes are the same: keep the option maps of the tables that did not change
+                options_cache.update((k, v) for k, v in self.options_cache.items() if k[0] not in blocks)
+                rebuild = blocks
+            else:
+                rebuild = list(table_cache)
+            for table in rebuild:
+                for (mode, side), mapping in build_options_index(table_cache[table], self.available_modes).items():
+                    options_cache[(table, mode, side)] = mapping
+
+            self._check_cancel()
+            if not load_tin:
+                self.table_cache, self.options_cache = table_cache, options_cache
+                return
+            if progress: progress(total, total, TIN_ALL_TABLE)
+            tin = None
+            try:
+                tin = self._patch_tin(conn)
+            except Exception:
+                conn.rollback()
+            if tin is None:
+                tin = TinIndex()
+                try:
+                    for row in conn.execute(text(self._tin_select())):
+                        tin.add(*row)
+                except Exception:
+                    pass
+        self._check_cancel()
+        self.table_cache, self.options_cache, self.tin_index = table_cache, options_cache, tin
+
+    def _tin_select(self, where: str = "") -> str:
+        pk_col = qident(self.tin_pk_col) if self.tin_pk_col else "NULL"
+        ref_col = qident(self.tin_ref_col)
+        desc_col = qident(self.tin_desc_col)
+        pack_col = qident(self.tin_pack_col) if self.tin_pack_col else "NULL"
+        list_col = qident(self.tin_price_list_col) if self.tin_price_list_col else "NULL"
+        trm_col  = qident(self.tin_price_trimm_col) if self.tin_price_trimm_col else "NULL"
+        return f'''
+            SELECT {pk_col} AS pk, {ref_col} AS ref, {desc_col} AS desc_ru, {pack_col} AS pack,
+                   {list_col} AS price_list, {trm_col} AS price_trimm
+            FROM {qident(TIN_ALL_TABLE)}
+            {where}
+        '''
+
+    def _patch_tin(self, conn):
+        """Применить к уже загруженному индексу только строки EVE TIN ALL, изменённые после прошлой синхронизации.
+
+        Возвращает новый TinIndex или None, если нужна полная перезагрузка:
+        нет первичного ключа, нет прошлого состояния, сменились столбцы или счётчик xid ушёл по кругу.
+        """
+        old = parse_fingerprint(self.fingerprints.get(TIN_ALL_TABLE))
+        new = parse_fingerprint(self._pending_fingerprints.get(TIN_ALL_TABLE))
+        since = self.sync_horizon
+        if not (self.tin_pk_col and self.tin_index.by_pk and old and new and since is not None):
+            return None
+        if old[2] != new[2] or self._pending_horizon is None or self._pending_horizon < since:
+            return None
+
+        delta = list(conn.execute(text(self._tin_select("WHERE xmin::text::bigint >= :since")), {"since": since}))
+        tin = self.tin_index.copy()
+        inserted = sum(1 for row in delta if pk_key(row[0]) not in tin.by_pk)
+        if new[0] != old[0] + inserted:
+            # rows were deleted: only now pay for the full list of keys
+            pk_sql = f'SELECT {qident(self.tin_pk_col)} FROM {qident(TIN_ALL_TABLE)}'
+            alive = {pk_key(pk) for (pk,) in conn.execute(text(pk_sql))}
+            for pk in [pk for pk in tin.by_pk if pk not in alive]:
+                tin.remove(pk)
+        for row in delta:
+            if row[1] is None:
+                tin.remove(row[0])
+            else:
+                tin.add(*row)
+        return tin
+
+    # ============== Templates ==============
+    def preload_templates(self):
+        templates: Dict[str, List[Tuple[str, int]]] = {}
+        self.templates_error = None
+        if self.engine is None:
+            self.templates = templates
+            return
+        cols = self.schema.columns(TEMPLATES_TABLE)
+        if not cols:
+            self.templates = templates
+            self.templates_error = f'Таблица "{TEMPLATES_TABLE}" не найдена — кнопки шаблонов пропущены.'
+            return
+
+        type_col = find_column(cols, ["Type", "Тип"])
+        pn_col   = find_column(cols, ["PN", "Кат. №", "Артикул", "Ref", "REF", "REF #", "REF#"])
+        qts_col  = find_column(cols, ["Qts"])
+
+        if not (type_col and pn_col):
+            self.templates = templates
+            self.templates_error = f'В таблице "{TEMPLATES_TABLE}" не найдены столбцы Type/PN.'
+            return
+
+        sel = f'SELECT {qident(type_col)} AS t, {qident(pn_col)} AS pn'
+        if qts_col:
+            sel += f', {qident(qts_col)} AS qts'
+        sel += f' FROM {qident(TEMPLATES_TABLE)}'
+
+        try:
+            with self.engine.connect() as conn:
+                for row in conn.execute(text(sel)):
+                    t = str(row[0] or "").strip()
+                    pn = norm_ref(row[1])
+                    if not t or not pn: continue
+                    if qts_col:
+                        raw_qts = row[2]
+                        try: q = int(float(raw_qts)) if raw_qts is not None else 1
+                        except Exception: q = 1
+                    else:
+                        q = 1
+                    key = t.lower()
+                    templates.setdefault(key, []).append((pn, max(1, q)))
+        except Exception as e:
+            self.templates_error = f'Ошибка чтения "{TEMPLATES_TABLE}": {e}'
+        self.templates = templates
+
+BLOCK_COLUMNS = ["DIV", "Disc Sh", "PN"]
+SIDE_COLUMNS = ["Side", "Сторона"]
+
+def block_select(table: str, cols, tag: int) -> Optional[str]:
+    if not all(c in cols for c in BLOCK_COLUMNS):
+        return None
+    side_expr = next((qident(c) for c in SIDE_COLUMNS if c in cols), "NULL")
+    return (f'SELECT {tag} AS tbl, {qident("DIV")}::text, {qident("Disc Sh")}::text, '
+            f'{qident("PN")}::text, {side_expr}::text AS "SIDE" FROM {qident(table)}')
+
+def block_row(row) -> Dict[str, str]:
+    return {
+        "DIV": (row[1] or "").strip(),
+        "Disc Sh": (row[2] or "").strip(),
+        "PN": norm_ref(row[3]),
+        "SIDE": (row[4] or "").strip() if row[4] is not None else ""
+    }
+
+def fetch_block_tables(conn, tables: List[str], schema: SchemaMap) -> Dict[str, List[Dict[str,str]]]:
+    """Все блок-таблицы одним UNION ALL. Отсутствующая или сломанная таблица даёт пустой список."""
+    result: Dict[str, List[Dict[str,str]]] = {t: [] for t in tables}
+    selects = {}
+    for tag, table in enumerate(tables):
+        sel = block_select(table, schema.columns(table), tag)
+        if sel: selects[tag] = sel
+    if not selects:
+        return result
+
+    try:
+        for row in conn.execute(text("\nUNION ALL\n".join(selects.values()))):
+            result[tables[row[0]]].append(block_row(row))
+        return result
+    except Exception:
+        conn.rollback()
+
+    # one of the tables is broken: load them one by one so only that table stays empty
+    for tag, sel in selects.items():
+        rows = []
+        try:
+            rows = [block_row(row) for row in conn.execute(text(sel))]
+        except Exception:
+            conn.rollback()
+        result[tables[tag]] = rows
+    return result
+
+def build_options_index(rows: List[Dict[str,str]], modes: List[str]) -> Dict[Tuple[str, Optional[str]], Dict[str, str]]:
+    """Варианты {Disc Sh: PN} для всех (mode, side) за один проход по строкам: строки с DIV == mode,
+    при заданной стороне — только без SIDE или с той же SIDE; при повторе Disc Sh берётся первый PN."""
+    sides = [s.strip().lower() for s in SIDES if s]
+    by_div: Dict[Tuple[str, Optional[str]], Dict[str, str]] = {}
+    for r in rows:
+        disc = r.get("Disc Sh",""); pn = r.get("PN","")
+        if not (disc and pn):
+            continue
+        div = (r.get("DIV") or "").strip().lower()
+        row_side = (r.get("SIDE") or "").strip().lower()
+        mapping = by_div.setdefault((div, None), {})
+        if disc not in mapping:
+            mapping[disc] = pn
+        for side in sides:
+            if row_side and row_side != side:
+                continue
+            mapping = by_div.setdefault((div, side), {})
+            if disc not in mapping:
+                mapping[disc] = pn
+
+    result: Dict[Tuple[str, Optional[str]], Dict[str, str]] = {}
+    for mode in modes:
+        want_mode = (mode or "").strip().lower()
+        for side in SIDES:
+            key = (want_mode, side.strip().lower() if side else None)
+            result[(mode, side)] = dict(by_div.get(key, {}))
+    return result
@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+"""Необязательные дополнения схемы БД для MAG Config и команда их установки.
+
+    python catalog_addons.py install notify
+    python catalog_addons.py remove notify
+    python catalog_addons.py install refindex
+    python catalog_addons.py check refindex
+
+Параметры подключения берутся из PGHOST/PGPORT/PGDATABASE/PGUSER/PGPASSWORD или --url.
+"""
+import os, sys, argparse
+from typing import Dict, List
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.engine import Engine
+
+from catalog import (
+    SOURCE_TABLES, TIN_ALL_TABLE, REF_NORM_FUNCTION, REF_INDEXES, Catalog, SchemaMap, qident, load_schema,
+    norm_ref, ref_key_exprs,
+)
+
+NOTIFY_CHANNEL = "mag_catalog"
+NOTIFY_FUNCTION = "mag_catalog_notify"
+
+def catalog_tables(schema: SchemaMap) -> List[str]:
+    return [t for t in SOURCE_TABLES if schema.has_table(t)]
+
+# ============== notify: LISTEN/NOTIFY on every catalog write ==============
+def notify_install_sql(schema: SchemaMap) -> List[str]:
+    tables = catalog_tables(schema)
+    sql = [f'''
+        CREATE OR REPLACE FUNCTION {NOTIFY_FUNCTION}() RETURNS trigger LANGUAGE plpgsql AS $$
+        BEGIN
+            PERFORM pg_notify('{NOTIFY_CHANNEL}', TG_TABLE_NAME);
+            RETURN NULL;
+        END
+        $$
+    ''']
+    for t in tables:
+        sql.append(f'DROP TRIGGER IF EXISTS {NOTIFY_FUNCTION} ON {qident(t)}')
+        # statement level: a bulk update sends one notification, not one per row
+        sql.append(f'CREATE TRIGGER {NOTIFY_FUNCTION} AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE '
+                   f'ON {qident(t)} FOR EACH STATEMENT EXECUTE PROCEDURE {NOTIFY_FUNCTION}()')
+    return sql
+
+def notify_remove_sql(schema: SchemaMap) -> List[str]:
+    sql = [f'DROP TRIGGER IF EXISTS {NOTIFY_FUNCTION} ON {qident(t)}' for t in catalog_tables(schema)]
+    sql.append(f'DROP FUNCTION IF EXISTS {NOTIFY_FUNCTION}()')
+    return sql
+
+# ============== refindex: indexed PN lookups in EVE TIN ALL ==============
+def refindex_install_sql(schema: SchemaMap) -> List[str]:
+    cat = Catalog()
+    cat.schema = schema
+    cat.detect_tin_columns()
+    # same rules as catalog.norm_ref, on text only: integral numbers lose leading zeros and ".000";
+    # the indexes are dropped and rebuilt below, so a changed function never leaves stale index keys
+    sql = [f'''
+        CREATE OR REPLACE FUNCTION {REF_NORM_FUNCTION}(ref text) RETURNS text
+        LANGUAGE sql IMMUTABLE PARALLEL SAFE AS $$
+            SELECT CASE
+                WHEN s ~ '^[0-9]+(\\.0+)?$' THEN coalesce(nullif(ltrim(split_part(s, '.', 1), '0'), ''), '0')
+                ELSE s
+            END
+            FROM (SELECT replace(trim(ref), ',', '.') AS s) q
+        $$
+    ''']
+    for name, expr in zip(REF_INDEXES, ref_key_exprs(cat.tin_ref_col)):
+        sql.append(f'DROP INDEX IF EXISTS {qident(name)}')
+        sql.append(f'CREATE INDEX {qident(name)} ON {qident(TIN_ALL_TABLE)} (({expr}))')
+    sql.append(f'ANALYZE {qident(TIN_ALL_TABLE)}')
+    return sql
+
+def refindex_remove_sql(schema: SchemaMap) -> List[str]:
+    sql = [f'DROP INDEX IF EXISTS {qident(name)}' for name in REF_INDEXES]
+    sql.append(f'DROP FUNCTION IF EXISTS {REF_NORM_FUNCTION}(text)')
+    return sql
+
+# inputs where a float round-trip or a numeric cast would disagree with the text rules
+NORM_REF_SAMPLES = (
+    "", "0", "000", "0.0", "123", "00123", "123.0", "123,0", "00123.0", "123.000", " 42 ", "123.5", "123.50",
+    "1.2.3", "A-123.0", "12345678901234567", "12345678901234567.0", "0012345678901234567,00",
+    "9007199254740993", "123456789012345678901234567890", "123.0000000000000000001",
+)
+
+def refindex_check(conn) -> List[str]:
+    """Сравнить mag_norm_ref в БД с catalog.norm_ref на образцах и на REF из "EVE TIN ALL";
+    возвращает расхождения."""
+    cat = Catalog()
+    cat.schema = load_schema(conn)
+    cat.detect_tin_columns()
+    values = list(NORM_REF_SAMPLES)
+    if cat.tin_ref_col:
+        ref = qident(cat.tin_ref_col)
+        values += conn.execute(text(f'SELECT DISTINCT {ref}::text FROM {qident(TIN_ALL_TABLE)} '
+                                    f'WHERE {ref} IS NOT NULL')).scalars().all()
+    rows = conn.execute(text(f"SELECT v, {REF_NORM_FUNCTION}(v) FROM unnest(CAST(:values AS text[])) AS v"),
+                        {"values": values})
+    return [f"{v!r}: БД {db!r}, Python {norm_ref(v)!r}" for v, db in rows if db != norm_ref(v)]
+
+ADDONS: Dict[str, Dict] = {
+    "notify": {"install": notify_install_sql, "remove": notify_remove_sql,
+               "help": "триггеры NOTIFY на таблицах каталога (мгновенное обновление открытых панелей)"},
+    "refindex": {"install": refindex_install_sql, "remove": refindex_remove_sql, "check": refindex_check,
+                 "help": f'индексы по ключам REF в "{TIN_ALL_TABLE}" (быстрый поиск позиции по PN)'},
+}
+
+def run_addon(engine: Engine, addon: str, action: str) -> List[str]:
+    with engine.begin() as conn:
+        schema = load_schema(conn)
+        statements = ADDONS[addon][action](schema)
+        for stmt in statements:
+            conn.execute(text(stmt))
+    return statements
+
+def env_url() -> str:
+    return "postgresql+psycopg://{}:{}@{}:{}/{}".format(
+        os.environ.get("PGUSER", "postgres"), os.environ.get("PGPASSWORD", ""),
+        os.environ.get("PGHOST", "127.0.0.1"), os.environ.get("PGPORT", "5432"),
+        os.environ.get("PGDATABASE", "mag_config"),
+    )
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description="Дополнения схемы БД MAG Config.")
+    ap.add_argument("action", choices=["install", "remove", "check"])
+    ap.add_argument("addon", choices=sorted(ADDONS),
+                    help="; ".join(f"{k}: {v['help']}" for k, v in sorted(ADDONS.items())))
+    ap.add_argument("--url", default=None, help="SQLAlchemy URL (по умолчанию из переменных PG*)")
+    args = ap.parse_args(argv)
+
+    engine = create_engine(args.url or env_url())
+    if args.action == "check":
+        check = ADDONS[args.addon].get("check")
+        if check is None:
+            print(f"{args.addon}: проверки нет", file=sys.stderr)
+            return 1
+        try:
+            with engine.connect() as conn:
+                problems = check(conn)
+        except Exception as e:
+            print(f"Ошибка: {e}", file=sys.stderr)
+            return 1
+        for p in problems:
+            print(p)
+        print(f"{args.addon}: check — расхождений: {len(problems)}")
+        return 1 if problems else 0
+    try:
+        statements = run_addon(engine, args.addon, args.action)
+    except Exception as e:
+        print(f"Ошибка: {e}", file=sys.stderr)
+        return 1
+    print(f"{args.addon}: {args.action} — выполнено команд: {len(statements)}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+"""Асинхронный доступ к БД каталога: psycopg AsyncConnection на своём цикле asyncio.
+
+Цикл крутится в отдельном потоке, окно Qt только отправляет корутины (submit) и получает
+concurrent.futures.Future — поэтому ожидание сети никогда не блокирует отрисовку.
+Одновременные запросы расходятся по небольшому пулу соединений, каждое держит свои
+подготовленные на сервере запросы.
+"""
+import asyncio, threading
+from concurrent.futures import Future
+from typing import Any, Coroutine, Dict, List, Optional
+
+import psycopg
+
+from catalog import Catalog, TinIndex
+
+class AsyncPool:
+    """Небольшой пул AsyncConnection; соединения открываются по мере надобности, не больше size."""
+    def __init__(self, conninfo: str, size: int = 3):
+        self.conninfo = conninfo
+        self.size = size
+        self._idle: List[psycopg.AsyncConnection] = []
+        self._opened = 0
+        self._freed: Optional[asyncio.Condition] = None
+
+    async def acquire(self) -> psycopg.AsyncConnection:
+        if self._freed is None:
+            self._freed = asyncio.Condition()
+        async with self._freed:
+            while not self._idle and self._opened >= self.size:
+                await self._freed.wait()
+            if self._idle:
+                return self._idle.pop()
+            self._opened += 1
+        try:
+            return await psycopg.AsyncConnection.connect(self.conninfo, autocommit=True)
+        except BaseException:
+            await self._forget()
+            raise
+
+    async def release(self, conn: psycopg.AsyncConnection, broken: bool = False):
+        if broken or conn.closed:
+            await conn.close()
+            await self._forget()
+            return
+        async with self._freed:
+            self._idle.append(conn)
+            self._freed.notify()
+
+    async def _forget(self):
+        async with self._freed:
+            self._opened -= 1
+            self._freed.notify()
+
+    async def close(self):
+        idle, self._idle = self._idle, []
+        for conn in idle:
+            await conn.close()
+
+class AsyncCatalogDb:
+    """Цикл asyncio в фоновом потоке и пул соединений к БД каталога."""
+    def __init__(self, conninfo: str, pool_size: int = 3):
+        # psycopg needs a selector loop (the Windows default proactor loop has no add_reader)
+        self.loop = asyncio.SelectorEventLoop()
+        self.pool = AsyncPool(conninfo, pool_size)
+        # lookup SQL by the detected EVE TIN ALL columns; only the loop thread touches it
+        self._tin_sql: Dict[tuple, str] = {}
+        self._thread = threading.Thread(target=self._run, name="catalog-async", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def submit(self, coro: Coroutine) -> Future:
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    async def fetch(self, sql: str, params: Dict[str, Any]) -> List[tuple]:
+        conn = await self.pool.acquire()
+        broken = False
+        try:
+            cur = await conn.execute(sql, params, prepare=True)
+            return await cur.fetchall()
+        except psycopg.OperationalError:
+            broken = True
+            raise
+        finally:
+            await self.pool.release(conn, broken)
+
+    async def fetch_tin(self, catalog: Catalog, pns: List[str]) -> TinIndex:
+        """Строки EVE TIN ALL для всех PN одним подготовленным запросом на соединении из пула;
+        найденное — во временном TinIndex, чтобы сопоставление PN -> строка шло по тем же ключам,
+        что и в загруженном индексе."""
+        found = TinIndex()
+        pns = [pn for pn in pns if pn]
+        if not pns or not catalog.tin_ref_col:
+            return found
+        for row in await self.fetch(self._tin_lookup_sql(catalog), catalog.tin_lookup_params(pns)):
+            found.add(*row)
+        return found
+
+    def _tin_lookup_sql(self, catalog: Catalog) -> str:
+        key = (catalog.tin_pk_col, catalog.tin_ref_col, catalog.tin_desc_col, catalog.tin_pack_col,
+               catalog.tin_price_list_col, catalog.tin_price_trimm_col, catalog.tin_ref_indexed)
+        sql = self._tin_sql.get(key)
+        if sql is None:
+            sql = self._tin_sql[key] = catalog.tin_lookup_sql("pyformat")
+        return sql
+
+    def close(self, timeout: float = 3.0):
+        if not self.loop.is_running():
+            return
+        try:
+            self.submit(self.pool.close()).result(timeout)
+        except Exception:
+            pass
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join(timeout)
+        if not self._thread.is_alive():
+            self.loop.close()
@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+"""Снимок каталога на диске (SQLite) — чтобы панель показывала данные сразу при запуске.
+
+Каждая исходная таблица хранится отдельной строкой (marshal + zlib) вместе со своим
+отпечатком, поэтому после синхронизации перезаписываются только изменившиеся таблицы.
+"""
+import os, sys, time, zlib, marshal, sqlite3, hashlib
+from typing import Dict, Iterable, Optional
+
+from catalog import (
+    Catalog, TinIndex, LABEL_TO_TABLE, TIN_ALL_TABLE, TEMPLATES_TABLE, MODES_TABLE, SOURCE_TABLES,
+    build_options_index,
+)
+
+FORMAT_VERSION = 5
+TIN_COLUMN_ATTRS = ("tin_pk_col", "tin_ref_col", "tin_desc_col", "tin_pack_col", "tin_price_list_col", "tin_price_trimm_col",
+                    "tin_ref_indexed")
+
+def cache_dir() -> str:
+    if sys.platform.startswith("win"):
+        base = os.environ.get("LOCALAPPDATA") or os.path.expanduser("~")
+    elif sys.platform == "darwin":
+        base = os.path.expanduser("~/Library/Caches")
+    else:
+        base = os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache")
+    return os.path.join(base, "MAG Config")
+
+def snapshot_path(host: str, port: str, database: str) -> str:
+    key = hashlib.md5(f"{host}:{port}/{database}".encode("utf-8")).hexdigest()[:16]
+    return os.path.join(cache_dir(), f"catalog_{key}.sqlite")
+
+def _pack(obj) -> bytes:
+    return zlib.compress(marshal.dumps(obj), 1)
+
+def _unpack(blob: bytes):
+    return marshal.loads(zlib.decompress(blob))
+
+def _encode(catalog: Catalog, table: str):
+    if table == MODES_TABLE:
+        return list(catalog.available_modes)
+    if table == TIN_ALL_TABLE:
+        return catalog.tin_index.dump()
+    if table == TEMPLATES_TABLE:
+        return catalog.templates
+    return [(r["DIV"], r["Disc Sh"], r["PN"], r["SIDE"]) for r in catalog.table_cache.get(table, [])]
+
+def _connect(path: str) -> sqlite3.Connection:
+    db = sqlite3.connect(path)
+    db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value BLOB)")
+    db.execute("CREATE TABLE IF NOT EXISTS source (name TEXT PRIMARY KEY, fingerprint TEXT, payload BLOB)")
+    return db
+
+def _format_key() -> bytes:
+    # marshal output is only guaranteed to round-trip within one Python version
+    return f"{FORMAT_VERSION}/{marshal.version}/{sys.version_info[0]}.{sys.version_info[1]}".encode()
+
+def load_snapshot(path: str, catalog: Catalog) -> bool:
+    """Заполнить каталог из снимка. False — снимка нет или он несовместим/повреждён."""
+    if not os.path.exists(path):
+        return False
+    try:
+        db = sqlite3.connect(path)
+        try:
+            meta = dict(db.execute("SELECT key, value FROM meta"))
+            if meta.get("format") != _format_key():
+                return False
+            sources = {name: (fp, payload) for name, fp, payload in
+                       db.execute("SELECT name, fingerprint, payload FROM source")}
+        finally:
+            db.close()
+
+        data = {name: _unpack(payload) for name, (_, payload) in sources.items()}
+        tin_cols = _unpack(meta["tin_columns"])
+    except Exception:
+        return False
+
+    catalog.available_modes = data.get(MODES_TABLE) or catalog.available_modes
+    table_cache = {}
+    for table in LABEL_TO_TABLE.values():
+        table_cache[table] = [{"DIV": d, "Disc Sh": s, "PN": p, "SIDE": sd}
+                              for d, s, p, sd in data.get(table, [])]
+    options_cache = {}
+    for table, rows in table_cache.items():
+        for (mode, side), mapping in build_options_index(rows, catalog.available_modes).items():
+            options_cache[(table, mode, side)] = mapping
+    catalog.table_cache, catalog.options_cache = table_cache, options_cache
+    catalog.tin_index = TinIndex.load(data[TIN_ALL_TABLE]) if TIN_ALL_TABLE in data else TinIndex()
+    catalog.templates = data.get(TEMPLATES_TABLE, {})
+    for attr, value in zip(TIN_COLUMN_ATTRS, tin_cols):
+        setattr(catalog, attr, value)
+
+    catalog.fingerprints = {name: fp for name, (fp, _) in sources.items() if fp}
+    catalog.snapshot_path = path
+    catalog.snapshot_time = float(meta.get("saved_at") or 0) or None
+    catalog.sync_horizon = int(meta["sync_horizon"]) if meta.get("sync_horizon") else None
+    return True
+
+def save_snapshot(path: str, catalog: Catalog, changed: Optional[Iterable[str]] = None):
+    """Записать снимок; changed — только эти таблицы (остальные уже лежат в файле)."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    changed = None if changed is None else set(changed)
+    tables = SOURCE_TABLES if changed is None else [t for t in SOURCE_TABLES if t in changed]
+    db = _connect(path)
+    try:
+        with db:
+            if db.execute("SELECT value FROM meta WHERE key = 'format'").fetchone() != (_format_key(),):
+                db.execute("DELETE FROM source")
+                tables = SOURCE_TABLES
+            rows = [(t, catalog.fingerprints.get(t), _pack(_encode(catalog, t))) for t in tables]
+            db.executemany("INSERT OR REPLACE INTO source (name, fingerprint, payload) VALUES (?, ?, ?)", rows)
+            meta: Dict[str, bytes] = {
+                "format": _format_key(),
+                "saved_at": str(time.time()).encode(),
+                "tin_columns": _pack(tuple(getattr(catalog, a) for a in TIN_COLUMN_ATTRS)),
+                "sync_horizon": str(catalog.sync_horizon or "").encode(),
+            }
+            db.executemany("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", meta.items())
+    finally:
+        db.close()
+    catalog.snapshot_path = path
+    catalog.snapshot_time = time.time()
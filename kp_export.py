@@ -0,0 +1,296 @@
+# -*- coding: utf-8 -*-
+"""Выгрузка КП в Excel по шаблону template.xlsx.
+
+Шаблон читается с диска один раз и держится в памяти, пока файл не изменится
+(mtime/размер). КП любой длины пишется потоком (stream_kp): части шаблона копируются
+в новый zip как есть (рисунки, объекты и внешние связи остаются), а XML листа
+собирается по строкам прямо в архив. Если строк больше, чем в шаблоне, подвал вместе
+с формулами, объединениями и якорями рисунков сдвигается вниз. Память не зависит
+от числа строк.
+"""
+import os, re, posixpath, threading, zipfile
+import xml.etree.ElementTree as ET
+from itertools import islice
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+from xml.sax.saxutils import escape, unescape
+
+FIRST_ROW = 5      # the first line goes into the template's header row
+LINES_ROW = 22     # the rest from here down
+LINES_LAST = 76    # last row of the template's line area; the totals below sum F4:F76
+LINE_COLUMNS = ("B", "C", "D", "E", "F")
+LINE_FIELDS = {"B": "pn", "C": "desc", "D": "qty", "E": "price"}   # F is the =E*D formula
+
+Line = Tuple[str, str, int, float]
+Progress = Callable[[int, int], None]   # (lines written, total)
+
+class KpTemplate:
+    """Разобранный template.xlsx с проверкой mtime."""
+    def __init__(self, path: str):
+        self.path = path
+        self._parts: Optional["TemplateParts"] = None
+        self._stamp: Optional[Tuple[int, int]] = None
+        self._lock = threading.Lock()   # guards the cache; exports themselves run side by side
+
+    def _stat(self) -> Tuple[int, int]:
+        st = os.stat(self.path)
+        return st.st_mtime_ns, st.st_size
+
+    def parts(self) -> "TemplateParts":
+        """Части zip шаблона; перечитываются, только если файл изменился."""
+        with self._lock:
+            stamp = self._stat()
+            if self._parts is None or stamp != self._stamp:
+                self._parts, self._stamp = TemplateParts(self.path), stamp
+            return self._parts
+
+    def prepare(self):
+        """Прочитать шаблон заранее (ошибки шаблона — здесь)."""
+        self.parts()
+
+    def export(self, items: Sequence[Line], out_path: str, progress: Optional[Progress] = None):
+        """Записать строки (pn, desc, qty, цена) в копию шаблона out_path.
+        Файл пишется рядом как .part и переименовывается, когда готов целиком."""
+        part_path = out_path + ".part"
+        try:
+            stream_kp(self.parts(), items, part_path, progress=progress)   # parts are read-only, shared by all exports
+            os.replace(part_path, out_path)
+        except BaseException:
+            try:
+                os.remove(part_path)
+            except OSError:
+                pass
+            raise
+
+# ============== streaming export ==============
+NS_MAIN = "{http://schemas.openxmlformats.org/spreadsheetml/2006/main}"
+NS_REL = "{http://schemas.openxmlformats.org/officeDocument/2006/relationships}"
+NS_PKG_REL = "{http://schemas.openxmlformats.org/package/2006/relationships}"
+
+ROW_RE = re.compile(r"<row\b[^>]*?(?:/>|>.*?</row>)", re.S)
+ROW_NUM_RE = re.compile(r'<row\b[^>]*?\br="(\d+)"')
+CELL_RE = re.compile(r'<c\b[^>]*?\br="([A-Z]+)\d+"[^>]*?(?:/>|>.*?</c>)', re.S)
+STYLE_RE = re.compile(r'\bs="(\d+)"')
+REF_ATTR_RE = re.compile(r'\b((?:s?ref|r)=")([^"]*)(")')
+ROW_ATTR_RE = re.compile(r'(<row\b[^>]*?\br=")(\d+)(")')
+FORMULA_RE = re.compile(r"(<f\b[^>]*>)(.*?)(</f>)", re.S)
+DEFINED_NAME_RE = re.compile(r"(<definedName\b[^>]*>)(.*?)(</definedName>)", re.S)
+CALC_PR_RE = re.compile(r"<calcPr\b[^>]*?/?>")
+AFTER_CALC_PR_RE = re.compile(r"<(?:oleSize|customWorkbookViews|pivotCaches|smartTagPr|smartTagTypes|webPublishing"
+                              r"|fileRecoveryPr|webPublishObjects|extLst)\b|</workbook>")
+# a string literal (left alone) or a cell/range reference with an optional sheet qualifier
+REF_RE = re.compile(r"""("(?:[^"]|"")*")"""
+                    r"""|(?<![\w.'\]$])(?:('(?:[^']|'')+'|[\w.\[\]]+)!)?(\$?[A-Z]{1,3}\$?)(\d+)"""
+                    r"""(?::(\$?[A-Z]{1,3}\$?)(\d+))?(?![\w(!])""")
+# drawing anchors count rows from 0: <xdr:row> in DrawingML and sheet objects, x:Anchor/x:Row in VML
+ANCHOR_ROW_RE = re.compile(r"(<(?:\w+:)?row>)(\d+)(</(?:\w+:)?row>)")
+VML_ANCHOR_RE = re.compile(r"(<x:Anchor>)([^<]*)(</x:Anchor>)")
+VML_ROW_RE = re.compile(r"(<x:Row>)(\d+)(</x:Row>)")
+ANCHORED_RELS = ("drawing", "vmlDrawing", "comments")   # sheet parts that point at rows of the sheet (comments by ref=)
+ILLEGAL_XML_RE = re.compile(r"[\x00-\x08\x0b\x0c\x0e-\x1f]")
+
+def shift_refs(formula: str, sheet: str, first_row: int, extra: int) -> str:
+    """Сдвинуть на extra ссылки на строки от first_row вниз, как при вставке строк в лист sheet.
+    Ссылки на другие листы и книги ([1]Лист!A1) не трогаются."""
+    def repl(m):
+        literal, qualifier, col1, row1, col2, row2 = m.groups()
+        if literal is not None:
+            return literal
+        if qualifier and qualifier.strip("'").replace("''", "'") != sheet:
+            return m.group(0)
+        def row(r: str) -> str:
+            return str(int(r) + extra) if int(r) >= first_row else r
+        ref = f"{qualifier + '!' if qualifier else ''}{col1}{row(row1)}"
+        return ref + (f":{col2}{row(row2)}" if col2 else "")
+    return REF_RE.sub(repl, formula) if extra else formula
+
+def _shift_xml(xml: str, sheet: str, first_row: int, extra: int) -> str:
+    """Ссылки в атрибутах r/ref/sqref и в формулах <f> фрагмента XML листа."""
+    if not extra:
+        return xml
+    xml = ROW_ATTR_RE.sub(lambda m: m.group(1) + str(int(m.group(2)) + extra if int(m.group(2)) >= first_row
+                                                     else m.group(2)) + m.group(3), xml)
+    xml = REF_ATTR_RE.sub(lambda m: m.group(1) + shift_refs(m.group(2), sheet, first_row, extra) + m.group(3), xml)
+    return FORMULA_RE.sub(lambda m: m.group(1) + escape(shift_refs(unescape(m.group(2)), sheet, first_row, extra))
+                          + m.group(3), xml)
+
+def _shift_anchors(xml: str, extra: int) -> str:
+    """Якоря рисунков, объектов и примечаний от строки LINES_LAST вниз — вместе с подвалом."""
+    if not extra:
+        return xml
+    def row(r: str) -> str:
+        return str(int(r) + extra) if int(r) + 1 >= LINES_LAST else r
+    def vml_anchor(m):
+        # LeftColumn, LeftOffset, TopRow, TopOffset, RightColumn, RightOffset, BottomRow, BottomOffset
+        values = [v.strip() for v in m.group(2).split(",")]
+        for i in (2, 6):
+            if i < len(values) and values[i].isdigit():
+                values[i] = row(values[i])
+        return m.group(1) + ", ".join(values) + m.group(3)
+    xml = ANCHOR_ROW_RE.sub(lambda m: m.group(1) + row(m.group(2)) + m.group(3), xml)
+    xml = VML_ROW_RE.sub(lambda m: m.group(1) + row(m.group(2)) + m.group(3), xml)
+    return VML_ANCHOR_RE.sub(vml_anchor, xml)
+
+def _part_path(base: str, target: str) -> str:
+    """Цель связи из .rels -> путь части в zip."""
+    return target.lstrip("/") if target.startswith("/") else posixpath.normpath(posixpath.join(base, target))
+
+def _sheet_from_workbook(parts: Dict[str, bytes]) -> Tuple[str, str]:
+    """(путь части XML, имя) активного листа — того, что openpyxl отдаёт как wb.active."""
+    wb = ET.fromstring(parts["xl/workbook.xml"])
+    view = wb.find(f"{NS_MAIN}bookViews/{NS_MAIN}workbookView")
+    active = int(view.get("activeTab", 0)) if view is not None else 0
+    sheet = wb.findall(f"{NS_MAIN}sheets/{NS_MAIN}sheet")[active]
+    rels = ET.fromstring(parts["xl/_rels/workbook.xml.rels"])
+    target = next(r.get("Target") for r in rels.iter(f"{NS_PKG_REL}Relationship") if r.get("Id") == sheet.get(f"{NS_REL}id"))
+    return _part_path("xl", target), sheet.get("name")
+
+class TemplateParts:
+    """Содержимое zip шаблона, разобранное для stream_kp: лист делится на начало, строки и конец."""
+    def __init__(self, path: str):
+        with zipfile.ZipFile(path) as zf:
+            self.infos = zf.infolist()
+            self.data = {info.filename: zf.read(info) for info in self.infos}
+        self.sheet_path, self.sheet_name = _sheet_from_workbook(self.data)
+        base, name = posixpath.split(self.sheet_path)
+        rels = self.data.get(posixpath.join(base, "_rels", name + ".rels"))
+        self.anchored = set() if rels is None else {
+            _part_path(base, r.get("Target")) for r in ET.fromstring(rels).iter(f"{NS_PKG_REL}Relationship")
+            if r.get("Type", "").rsplit("/", 1)[-1] in ANCHORED_RELS and r.get("TargetMode") != "External"}
+        xml = self.data[self.sheet_path].decode("utf-8")
+        start = xml.index("<sheetData")
+        end = xml.index("</sheetData>")
+        if xml[start:xml.index(">", start) + 1].endswith("/>"):
+            raise ValueError("в листе шаблона нет строк")
+        body_start = xml.index(">", start) + 1
+        self.head, self.tail = xml[:body_start], xml[end:]
+        self.rows: Dict[int, str] = {int(ROW_NUM_RE.match(r).group(1)): r for r in ROW_RE.findall(xml[body_start:end])}
+        proto = self.rows.get(LINES_LAST) or self.rows.get(LINES_ROW, f'<row r="{LINES_LAST}"></row>')
+        proto_cells = _cells(proto)
+        # line rows use the template's own row where there is one, its last line row below that
+        self.line_formats = {r: _line_format(row, proto_cells) for r, row in self.rows.items()
+                             if r == FIRST_ROW or LINES_ROW <= r <= LINES_LAST}
+        self.proto_format = _line_format(proto, proto_cells)
+
+    def line_row(self, r: int, rec: Line) -> str:
+        """XML строки листа r с позицией rec."""
+        pn, desc, qty, unit_price = rec
+        amount = qty * unit_price if isinstance(unit_price, (int, float)) else 0
+        return self.line_formats.get(r, self.proto_format).format(
+            r=r, pn=_cell_tail(pn), desc=_cell_tail(desc), qty=_cell_tail(qty), price=_cell_tail(unit_price),
+            amount=amount)
+
+def _cells(row_xml: str) -> Dict[str, str]:
+    return {m.group(1): m.group(0) for m in CELL_RE.finditer(row_xml)}
+
+def _braces(xml: str) -> str:
+    return xml.replace("{", "{{").replace("}", "}}")
+
+def _line_format(template_row: str, proto_cells: Dict[str, str]) -> str:
+    """Строка листа как шаблон str.format; стили ячеек — из строки шаблона, недостающие — из прототипа.
+    Формат разбирается один раз на строку шаблона, а не на каждую позицию КП."""
+    cells = _cells(template_row)
+    tag = template_row[:template_row.index(">") + 1]
+    if tag.endswith("/>"):
+        tag = tag[:-2] + ">"
+    out = [re.sub(r'\br="\d+"', 'r="{r}"', _braces(tag), count=1)]
+    for col in sorted(set(cells) | set(LINE_COLUMNS), key=lambda c: (len(c), c)):
+        m = STYLE_RE.search(cells.get(col) or proto_cells.get(col) or "")
+        style = f' s="{m.group(1)}"' if m else ""
+        if col in LINE_FIELDS:
+            out.append(f'<c r="{col}{{r}}"{style}{{{LINE_FIELDS[col]}}}')
+        elif col == "F":
+            out.append(f'<c r="F{{r}}"{style}><f>E{{r}}*D{{r}}</f><v>{{amount!r}}</v></c>')
+        else:
+            out.append(re.sub(r'\br="[A-Z]+\d+"', f'r="{col}{{r}}"', _braces(cells[col]), count=1))
+    out.append("</row>")
+    return "".join(out)
+
+def _cell_tail(value) -> str:
+    """Окончание <c r=.. s=..: пустая ячейка, строка (inlineStr) или число."""
+    if value is None or value == "":
+        return "/>"
+    if isinstance(value, str):
+        return f' t="inlineStr"><is><t xml:space="preserve">{escape(ILLEGAL_XML_RE.sub("", value))}</t></is></c>'
+    return f"><v>{value!r}</v></c>"
+
+def _workbook_xml(parts: TemplateParts, extra: int) -> bytes:
+    """workbook.xml: сдвинутые области печати и именованные диапазоны листа, пересчёт при открытии."""
+    xml = parts.data["xl/workbook.xml"].decode("utf-8")
+    xml = DEFINED_NAME_RE.sub(lambda m: m.group(1) + escape(shift_refs(unescape(m.group(2)), parts.sheet_name, LINES_LAST,
+                                                                       extra)) + m.group(3), xml)
+    calc = CALC_PR_RE.search(xml)
+    if calc is None:
+        at = AFTER_CALC_PR_RE.search(xml).start()
+        xml = xml[:at] + '<calcPr fullCalcOnLoad="1"/>' + xml[at:]
+    elif "fullCalcOnLoad" not in calc.group(0):
+        tag = calc.group(0)
+        tag = tag[:-2] + ' fullCalcOnLoad="1"/>' if tag.endswith("/>") else tag[:-1] + ' fullCalcOnLoad="1">'
+        xml = xml[:calc.start()] + tag + xml[calc.end():]
+    return xml.encode("utf-8")
+
+def _without_calc_chain(name: str, data: bytes) -> bytes:
+    # calcChain lists the template's formula cells; Excel rebuilds it, a stale one makes it "repair" the file
+    xml = data.decode("utf-8")
+    if name == "[Content_Types].xml":
+        xml = re.sub(r'<Override\b[^>]*PartName="/xl/calcChain\.xml"[^>]*/>', "", xml)
+    else:
+        xml = re.sub(r'<Relationship\b[^>]*Target="[^"]*calcChain\.xml"[^>]*/>', "", xml)
+    return xml.encode("utf-8")
+
+def stream_kp(parts: TemplateParts, items: Sequence[Line], out_path: str, chunk_rows: int = 512,
+              progress: Optional[Progress] = None):
+    """Записать КП потоком: строки листа уходят в zip пачками по chunk_rows, подвал шаблона сдвигается вниз."""
+    rest = len(items) - 1
+    extra = max(0, LINES_ROW + rest - 1 - LINES_LAST)
+    lines_end = LINES_ROW + rest   # first row after the written lines
+    sheet = parts.sheet_name
+
+    def lines():
+        for i, rec in enumerate(islice(items, 1, None)):
+            if progress and i % chunk_rows == 0:
+                progress(i + 1, len(items))
+            yield parts.line_row(LINES_ROW + i, rec)
+
+    def sheet_rows():
+        yield _shift_xml(parts.head, sheet, LINES_LAST, extra)
+        written = False
+        for r in sorted(set(parts.rows) | {FIRST_ROW}):
+            if r >= LINES_ROW and not written:
+                yield from lines()
+                written = True
+            if r == FIRST_ROW:
+                yield parts.line_row(r, items[0])
+            elif r > LINES_LAST:
+                yield _shift_xml(parts.rows[r], sheet, LINES_LAST, extra)
+            elif not LINES_ROW <= r < lines_end:
+                yield parts.rows[r]
+        if not written:
+            yield from lines()
+        yield _shift_anchors(_shift_xml(parts.tail, sheet, LINES_LAST, extra), extra)
+
+    with zipfile.ZipFile(out_path, "w", zipfile.ZIP_DEFLATED) as zf:
+        for info in parts.infos:
+            name = info.filename
+            if name == "xl/calcChain.xml":
+                continue
+            part = zipfile.ZipInfo(name, info.date_time)
+            part.compress_type = zipfile.ZIP_DEFLATED
+            if name == parts.sheet_path:
+                with zf.open(part, "w", force_zip64=True) as out:
+                    buf: List[str] = []
+                    for xml in sheet_rows():
+                        buf.append(xml)
+                        if len(buf) >= chunk_rows:
+                            out.write("".join(buf).encode("utf-8"))
+                            buf.clear()
+                    out.write("".join(buf).encode("utf-8"))
+                continue
+            data = parts.data[name]
+            if name == "xl/workbook.xml":
+                data = _workbook_xml(parts, extra)
+            elif name in ("[Content_Types].xml", "xl/_rels/workbook.xml.rels"):
+                data = _without_calc_chain(name, data)
+            elif name in parts.anchored and extra:
+                # latin-1 round-trips any bytes: VML is not always UTF-8, and only ASCII digits change
+                data = _shift_anchors(_shift_xml(data.decode("latin-1"), sheet, LINES_LAST, extra), extra).encode("latin-1")
+            zf.writestr(part, data)
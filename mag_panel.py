@@ -1,74 +1,33 @@
 # -*- coding: utf-8 -*-
-import sys, re, os, subprocess
-from dataclasses import dataclass
-from typing import Dict, Optional, Tuple, List
-from functools import partial
+import sys, os, threading
+from collections import deque
+from contextlib import contextmanager, nullcontext
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, Any, Callable, Deque, Dict, Iterable, Optional, Set, Tuple, List
 from datetime import datetime
 
 from PySide6 import QtWidgets, QtCore
 from PySide6.QtWidgets import QDialog, QFormLayout, QDialogButtonBox
-from sqlalchemy import create_engine, text, inspect
-from sqlalchemy.engine import Engine
-
-try:
-    import openpyxl
-except Exception:
-    openpyxl = None
-
-LABEL_TO_TABLE = {
-    "Аппарат ИВЛ": "Block_Main",
-    "Лицензия": "License",
-    "Контуры": "Circuits",
-    "Клапаны, датчики": "Valves",
-    "Маски": "Masks",
-    "Мобильная стойка": "Mobile_Cart",
-    "Автокрепления": "Holders",
-    "Увлажнитель": "Humidifier",
-    "Датчик CO2": "CO2",
-    "Датчик SpO2": "O2",
-}
-TIN_ALL_TABLE = 'EVE TIN ALL'
-TEMPLATES_TABLE = 'Templates'
-MODES_TABLE = 'Modes'
-MODES_COL = 'Mode'
-
-ORDERED_LABELS = [
-    "Аппарат ИВЛ","Лицензия","Контуры","Клапаны, датчики",
-    "Маски","Мобильная стойка","Автокрепления","Увлажнитель",
-    "Датчик CO2","Датчик SpO2"
-]
-
-def qident(name: str) -> str:
-    return '"' + name.replace('"','""') + '"'
-
-def has_columns(engine: Engine, table: str, cols: List[str]) -> Dict[str, bool]:
-    insp = inspect(engine)
-    existing = {c['name'] for c in insp.get_columns(table)}
-    return {c: (c in existing) for c in cols}
-
-def norm_ref(x) -> str:
-    if x is None: return ""
-    s = str(x).strip().replace(",", ".")
-    m = re.match(r"^(\d+)\.0$", s)
-    if m: return m.group(1)
-    try:
-        if re.match(r"^\d+(\.\d+)?$", s):
-            f = float(s)
-            if f.is_integer(): return str(int(f))
-    except Exception:
-        pass
-    return s
-
-def digits_only(s: str) -> str:
-    return re.sub(r"\D", "", s or "")
-
-def parse_money(s: Optional[str]) -> Optional[float]:
-    if s is None: return None
-    t = str(s).strip().replace(",", ".")
-    try:
-        return float(t)
-    except Exception:
-        return None
+
+from catalog import (
+    LABEL_TO_TABLE, TIN_ALL_TABLE, TEMPLATES_TABLE, MODES_TABLE, ORDERED_LABELS, SOURCE_TABLES,
+    Catalog, TinIndex, TinRecord, LoadCancelled,
+)
+from quote import QuoteEngine, QuoteLine, contiguous_runs, fmt_minor, lines_from_records
+from catalog_snapshot import snapshot_path, load_snapshot, save_snapshot
+
+# SQLAlchemy, psycopg, kp_export and subprocess load on first use (connect, export), not at startup;
+# benchmarks/bench_startup.py keeps an eye on the cold-start cost
+if TYPE_CHECKING:
+    from sqlalchemy.engine import Engine
+    from catalog_async import AsyncCatalogDb
+    from kp_export import KpTemplate
+
+# from this many rows on, summary edits go through Panel._bulk_summary (one model reset)
+BULK_ROWS = 100
+
+# MAG_DEBUG=1: every totals update is checked against a full recompute of the summary
+DEBUG = os.environ.get("MAG_DEBUG", "") not in ("", "0")
 
 def fmt_money(x: Optional[float]) -> str:
     if x is None: return ""
@@ -85,48 +44,330 @@ class RowControl:
     combo: QtWidgets.QComboBox
     spin: QtWidgets.QSpinBox
 
-class Panel(QtWidgets.QWidget):
-    COL_NO = 0
-    COL_PN = 1
-    COL_DESC = 2
-    COL_QTY = 3
-    COL_CTRL = 4
-    COL_PACK = 5
-    COL_PRICE_LIST = 6
-    COL_PRICE_TRIMM = 7
-
-    USERROLE_BASE_TRIMM = QtCore.Qt.UserRole + 1
-    USERROLE_LIST_PRICE = QtCore.Qt.UserRole + 2
+@dataclass
+class PendingRows:
+    """Строки, ждущие ответа БД; в сводку попадают строго в порядке добавления."""
+    items: List[Tuple[str, int]]
+    on_added: Optional[Callable[[int], None]] = None
+    found: Dict[str, TinRecord] = field(default_factory=dict)
+    missing: List[str] = field(default_factory=list)
+    ready: bool = False
+
+class AsyncResults(QtCore.QObject):
+    """Передаёт результаты корутин AsyncCatalogDb в поток GUI."""
+    ready = QtCore.Signal(object, object, object)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.ready.connect(self._deliver)
+
+    def watch(self, future, callback: Callable[[Any, Optional[BaseException]], None]):
+        def done(f):
+            if f.cancelled():
+                return
+            err = f.exception()
+            try:
+                self.ready.emit(callback, None if err else f.result(), err)
+            except RuntimeError:
+                pass  # the window is already gone
+        future.add_done_callback(done)
+
+    @QtCore.Slot(object, object, object)
+    def _deliver(self, callback, result, error):
+        callback(result, error)
+
+class SummaryModel(QtCore.QAbstractTableModel):
+    """Сводка в QTableView поверх QuoteEngine: строки и цены хранит движок, модель их только показывает.
+
+    № и цена ТРИММ с логистикой не хранятся, а считаются в data() для видимых ячеек.
+    """
+    COL_NO, COL_PN, COL_DESC, COL_QTY, COL_CTRL, COL_PACK, COL_PRICE_LIST, COL_PRICE_TRIMM = range(8)
+    HEADERS = ("№", "Кат. №", "Описаное", "К-во", "Control", "шт/уп", "Стоимость", "Цена ТРИММ")
+    EDITABLE = (COL_PN, COL_DESC, COL_QTY, COL_CTRL, COL_PACK)
+    # looking up QtCore.Qt enums costs microseconds each, and data() runs for every visible cell and role
+    DISPLAY, EDIT = QtCore.Qt.DisplayRole, QtCore.Qt.EditRole
+    FLAGS_RO = QtCore.Qt.ItemIsEnabled | QtCore.Qt.ItemIsSelectable
+    FLAGS_RW = FLAGS_RO | QtCore.Qt.ItemIsEditable
+
+    def __init__(self, quote: QuoteEngine, parent=None):
+        super().__init__(parent)
+        self.quote = quote
+        self._bulk = 0
+
+    def rowCount(self, parent=QtCore.QModelIndex()) -> int:
+        return 0 if parent.isValid() else len(self.quote)
+
+    def columnCount(self, parent=QtCore.QModelIndex()) -> int:
+        return 0 if parent.isValid() else len(self.HEADERS)
+
+    def headerData(self, section, orientation, role=QtCore.Qt.DisplayRole):
+        if orientation == QtCore.Qt.Horizontal and role == QtCore.Qt.DisplayRole:
+            return self.HEADERS[section]
+        return super().headerData(section, orientation, role)
+
+    def flags(self, index):
+        return self.FLAGS_RW if index.column() in self.EDITABLE else self.FLAGS_RO
+
+    def data(self, index, role=QtCore.Qt.DisplayRole):
+        if (role != self.DISPLAY and role != self.EDIT) or not index.isValid():
+            return None
+        r, c, q = index.row(), index.column(), self.quote
+        if c == self.COL_NO:
+            return str(r + 1)
+        if c == self.COL_PN:
+            return q.pns[r]
+        if c == self.COL_DESC:
+            return q.descs[r]
+        if c == self.COL_QTY:
+            return q.qtys[r] if role == self.EDIT else str(q.qtys[r])
+        if c == self.COL_CTRL:
+            return q.ctrls[r]
+        if c == self.COL_PACK:
+            return q.packs[r]
+        if c == self.COL_PRICE_LIST:
+            return fmt_minor(q.list_price(r))
+        if c == self.COL_PRICE_TRIMM:
+            return fmt_minor(q.trimm_price(r))
+        return None
+
+    def setData(self, index, value, role=QtCore.Qt.EditRole):
+        if role != self.EDIT or not index.isValid():
+            return False
+        r, c, q = index.row(), index.column(), self.quote
+        if c == self.COL_QTY:
+            try:
+                q.set_qty(r, max(0, int(float(str(value).replace(",", ".") or "0"))))
+            except (TypeError, ValueError, OverflowError):
+                return False
+        elif c in self.EDITABLE:
+            column = {self.COL_PN: q.pns, self.COL_DESC: q.descs, self.COL_CTRL: q.ctrls, self.COL_PACK: q.packs}[c]
+            column[r] = "" if value is None else str(value)
+        else:
+            return False
+        if not self._bulk:
+            self.dataChanged.emit(index, index, [self.DISPLAY, self.EDIT])
+        return True
+
+    @contextmanager
+    def bulk(self):
+        """Массовая правка: без сигналов на каждую операцию, в конце один modelReset."""
+        if not self._bulk:
+            self.beginResetModel()
+        self._bulk += 1
+        try:
+            yield self
+        finally:
+            self._bulk -= 1
+            if not self._bulk:
+                self.endResetModel()
+
+    def append_lines(self, lines: List[QuoteLine]):
+        """Добавить строки КП — один rowsInserted на весь список."""
+        if not lines:
+            return
+        start = len(self.quote)
+        if not self._bulk:
+            self.beginInsertRows(QtCore.QModelIndex(), start, start + len(lines) - 1)
+        self.quote.add_lines(lines)
+        if not self._bulk:
+            self.endInsertRows()
+
+    def remove_rows(self, rows: Iterable[int]):
+        for first, last in contiguous_runs(rows):
+            if not self._bulk:
+                self.beginRemoveRows(QtCore.QModelIndex(), first, last)
+            self.quote.remove_range(first, last)
+            if not self._bulk:
+                self.endRemoveRows()
+
+    def move_row(self, src: int, dst: int):
+        """Переставить строку src на место перед dst (как QAbstractItemModel.moveRows)."""
+        n = len(self.quote)
+        if not (0 <= src < n and 0 <= dst <= n) or dst in (src, src + 1):
+            return
+        if not self._bulk:
+            self.beginMoveRows(QtCore.QModelIndex(), src, src, QtCore.QModelIndex(), dst)
+        self.quote.move(src, dst)
+        if not self._bulk:
+            self.endMoveRows()
+
+    def clear_pns(self):
+        self.quote.clear_pns()
+        self._column_changed(self.COL_PN)
+
+    def prices_changed(self):
+        """Скидка/логистика/курс в движке изменились — перечитать столбец ТРИММ."""
+        self._column_changed(self.COL_PRICE_TRIMM)
+
+    def _column_changed(self, col: int):
+        if len(self.quote) and not self._bulk:
+            self.dataChanged.emit(self.index(0, col), self.index(len(self.quote) - 1, col), [self.DISPLAY])
+
+class CatalogLoader(QtCore.QObject):
+    """Загружает каталог в фоновом потоке и сообщает о готовности каждого этапа."""
+    stage = QtCore.Signal(object, str)
+    modes_ready = QtCore.Signal(object)
+    tables_ready = QtCore.Signal(object)
+    templates_ready = QtCore.Signal(object)
+    failed = QtCore.Signal(object, str)
+    finished = QtCore.Signal(object)
+
+    def __init__(self, catalog: Catalog, tables: Optional[Set[str]] = None):
+        super().__init__()
+        self.catalog = catalog
+        self.tables = tables
+
+    def cancel(self):
+        self.catalog.cancel()
+
+    @QtCore.Slot()
+    def run(self):
+        cat = self.catalog
+        try:
+            self.stage.emit(cat, "Чтение схемы БД…")
+            cat.load_schema()
+            cat._check_cancel()
+
+            self.stage.emit(cat, "Проверка актуальности каталога…")
+            changed = cat.changed_sources(self.tables)
+            cat._check_cancel()
+
+            if MODES_TABLE in changed:
+                self.stage.emit(cat, "Загрузка режимов…")
+                cat.load_modes()
+                cat._check_cancel()
+            self.modes_ready.emit(cat)
+
+            self.stage.emit(cat, f'Определение столбцов "{TIN_ALL_TABLE}"…')
+            cat.detect_tin_columns()
+            cat.detect_ref_index()
+            cat.preload_all_db(progress=lambda i, n, name: self.stage.emit(cat, f"Загрузка данных: {name} ({i}/{n})…"),
+                               only=changed)
+            self.tables_ready.emit(cat)
+
+            if TEMPLATES_TABLE in changed:
+                self.stage.emit(cat, "Загрузка шаблонов…")
+                cat.preload_templates()
+                cat._check_cancel()
+            self.templates_ready.emit(cat)
+
+            cat.commit_fingerprints()
+            if changed and cat.snapshot_path:
+                self.stage.emit(cat, "Сохранение снимка каталога…")
+                try:
+                    save_snapshot(cat.snapshot_path, cat, changed)
+                except Exception:
+                    pass
+        except LoadCancelled:
+            pass
+        except Exception as e:
+            self.failed.emit(cat, str(e))
+        finally:
+            self.finished.emit(cat)
+
+class CatalogListener(QtCore.QObject):
+    """Слушает NOTIFY об изменениях каталога на отдельном соединении (см. catalog_addons.py)."""
+    notified = QtCore.Signal(str)
+    finished = QtCore.Signal()
+
+    def __init__(self, conninfo: str):
+        super().__init__()
+        self.conninfo = conninfo
+        self._stop = threading.Event()
+
+    def stop(self):
+        self._stop.set()
+
+    @QtCore.Slot()
+    def run(self):
+        import psycopg
+        from catalog_addons import NOTIFY_CHANNEL
+        while not self._stop.is_set():
+            try:
+                with psycopg.connect(self.conninfo, autocommit=True) as conn:
+                    conn.execute(f"LISTEN {NOTIFY_CHANNEL}")
+                    while not self._stop.is_set():
+                        for n in conn.notifies(timeout=0.5):
+                            self.notified.emit(n.payload)
+            except Exception:
+                # server restart or network hiccup: retry quietly
+                self._stop.wait(5.0)
+        self.finished.emit()
+
+class KpExporter(QtCore.QObject):
+    """Пишет КП в фоновом потоке; строки — снимок сводки на момент нажатия."""
+    progress = QtCore.Signal(object, int, int)
+    saved = QtCore.Signal(object)
+    failed = QtCore.Signal(object, str)
+    finished = QtCore.Signal(object)
+
+    def __init__(self, template: "KpTemplate", items: List[Tuple[str, str, int, float]], out_path: str):
+        super().__init__()
+        self.template = template
+        self.items = items
+        self.out_path = out_path
 
+    @QtCore.Slot()
+    def run(self):
+        try:
+            try:
+                self.template.prepare()   # parsed once, again only after template.xlsx changes
+            except Exception as e:
+                self.failed.emit(self, f"Не удалось открыть шаблон:\n{e}")
+                return
+            try:
+                self.template.export(self.items, self.out_path,
+                                     progress=lambda i, n: self.progress.emit(self, i, n))
+            except Exception as e:
+                self.failed.emit(self, f"Не удалось сохранить файл:\n{e}")
+                return
+            self.saved.emit(self)
+        finally:
+            self.finished.emit(self)
+
+class Panel(QtWidgets.QWidget):
     def __init__(self):
         super().__init__()
         self.setWindowTitle("MAG Config — DB")
         self.setMinimumWidth(1400)
 
-        self.engine: Optional[Engine] = None
-        self.inspector = None
-
-        self.available_modes: List[str] = ["EVE", "S", "F"]
-        self.current_mode = self.available_modes[0]
+        self.engine: Optional["Engine"] = None
+        self.catalog = Catalog()
+        self.quote = QuoteEngine()
+        self._async_db: Optional["AsyncCatalogDb"] = None
+        self._async_results = AsyncResults(self)
+        self._pending_rows: Deque[PendingRows] = deque()
+        self._loader: Optional[CatalogLoader] = None
+        self._loader_thread: Optional[QtCore.QThread] = None
+        self._stale_loaders: List[CatalogLoader] = []
+        self._indexer: Optional[Tuple[threading.Thread, Catalog, TinIndex]] = None
+        self._listener: Optional[CatalogListener] = None
+        self._listener_thread: Optional[QtCore.QThread] = None
+        self._notified_tables: Set[str] = set()
+        self._notify_timer = QtCore.QTimer(self)
+        self._notify_timer.setSingleShot(True)
+        self._notify_timer.setInterval(300)
+        self._notify_timer.timeout.connect(self._on_notify_timer)
+        # spinbox drags: at most one reprice per frame, however many steps arrive in between
+        self._reprice_timer = QtCore.QTimer(self)
+        self._reprice_timer.setSingleShot(True)
+        self._reprice_timer.setInterval(16)
+        self._reprice_timer.timeout.connect(self._reprice)
+
+        self.current_mode = self.catalog.available_modes[0]
         self.side_filter: Optional[str] = None
 
         self.labels: List[str] = ORDERED_LABELS[:]
         self.row_controls: List[RowControl] = []
+        self.template_buttons: List[QtWidgets.QPushButton] = []
 
-        self.table_cache: Dict[str, List[Dict[str,str]]] = {}
-        self.options_cache: Dict[Tuple[str, str, Optional[str]], Dict[str, str]] = {}
-        self.tin_index: Dict[str, Tuple[str, Optional[str], Optional[str], Optional[str]]] = {}
-
-        self.tin_ref_col = None
-        self.tin_desc_col = None
-        self.tin_pack_col = None
-        self.tin_price_list_col = None
-        self.tin_price_trimm_col = None
+        self._lookup_stats = {"index": 0, "db": 0, "miss": 0, "failed": 0}
+        self._bulk_depth = 0
+        self._kp_template: Optional["KpTemplate"] = None
+        self._exports: List[Tuple[KpExporter, QtCore.QThread]] = []
 
-        self.templates: Dict[str, List[Tuple[str, int]]] = {}
-
-        self._building_table = False
         self._build_ui()
+        self._load_snapshot()
 
     # ================= UI =================
     def _build_ui(self):
@@ -147,10 +388,19 @@ class Panel(QtWidgets.QWidget):
         self.btnAdmin.clicked.connect(self._launch_admin_tool)
         self.btnConn = QtWidgets.QPushButton("Настроить подключение к БД")
         self.btnConn.clicked.connect(self._show_conn_dialog)
+        self.btnRefresh = QtWidgets.QPushButton("Обновить каталог")
+        self.btnRefresh.setEnabled(False)
+        self.btnRefresh.clicked.connect(lambda _: self.refresh_catalog())
+        self.chkLookupDb = QtWidgets.QCheckBox("Цены напрямую из БД")
+        self.chkLookupDb.setToolTip("Искать каждую позицию запросом к БД, а не в загруженном каталоге")
 
         header = QtWidgets.QHBoxLayout()
         header.addWidget(self.modeBar)
         header.addStretch(1)
+        header.addWidget(self.chkLookupDb)
+        header.addSpacing(8)
+        header.addWidget(self.btnRefresh)
+        header.addSpacing(8)
         header.addWidget(self.btnAdmin)
         header.addSpacing(8)
         header.addWidget(self.btnConn)
@@ -163,12 +413,25 @@ class Panel(QtWidgets.QWidget):
         self.summaryBox = QtWidgets.QGroupBox("Сводка")
         rlay = QtWidgets.QVBoxLayout(self.summaryBox)
 
-        self.table = QtWidgets.QTableWidget(0, 8)
-        self.table.setHorizontalHeaderLabels([
-            "№","Кат. №","Описаное","К-во","Control","шт/уп","Стоимость","Цена ТРИММ"
-        ])
+        self.pnSearchEdit = QtWidgets.QLineEdit()
+        self.pnSearchEdit.setPlaceholderText("Поиск: начало PN, цифры из середины PN или слова наименования; Enter — добавить")
+        self.pnSearchEdit.setClearButtonEnabled(True)
+        self.pnSearchEdit.textChanged.connect(self._on_pn_search)
+        self.pnSearchEdit.returnPressed.connect(self._add_pn_search_result)
+        self.pnResults = QtWidgets.QListWidget()
+        self.pnResults.setMaximumHeight(160)
+        self.pnResults.hide()
+        self.pnResults.itemActivated.connect(self._add_pn_search_result)
+        rlay.addWidget(self.pnSearchEdit)
+        rlay.addWidget(self.pnResults)
+
+        self.summaryModel = SummaryModel(self.quote, self)
+        self.summaryModel.dataChanged.connect(self._on_summary_changed)
+        self.table = QtWidgets.QTableView()
+        self.table.setModel(self.summaryModel)
         self.table.horizontalHeader().setStretchLastSection(True)
-        self.table.itemChanged.connect(self._on_table_item_changed)
+        # uniform rows: the view does not measure each one when thousands are inserted
+        self.table.verticalHeader().setSectionResizeMode(QtWidgets.QHeaderView.Fixed)
         rlay.addWidget(self.table)
 
         row_ops = QtWidgets.QHBoxLayout()
@@ -207,6 +470,8 @@ class Panel(QtWidgets.QWidget):
             controls.addSpacing(12)
         controls.addStretch(1)
         rlay.addLayout(controls)
+        for spin in (self.discountSpin, self.logisticsSpin, self.kursSpin):
+            spin.valueChanged.connect(self._schedule_reprice)
 
         totals = QtWidgets.QHBoxLayout()
         self.lbl_total = QtWidgets.QLabel("Итого: 0.00")
@@ -229,11 +494,16 @@ class Panel(QtWidgets.QWidget):
         split.setStretchFactor(1, 1)
 
         self.status = QtWidgets.QLabel("Нажмите «Настроить подключение к БД» для подключения к базе.")
+        self.lookupLabel = QtWidgets.QLabel()
+        self._update_lookup_label()
+        status_row = QtWidgets.QHBoxLayout()
+        status_row.addWidget(self.status, 1)
+        status_row.addWidget(self.lookupLabel)
 
         main = QtWidgets.QVBoxLayout(self)
         main.addLayout(header)
         main.addWidget(split, 1)
-        main.addWidget(self.status)
+        main.addLayout(status_row)
 
     def _rebuild_mode_strip(self):
         while self.modeBarLayout.count():
@@ -241,7 +511,7 @@ class Panel(QtWidgets.QWidget):
             w = item.widget()
             if w: w.deleteLater()
 
-        modes = [m for m in self.available_modes if str(m).strip()]
+        modes = [m for m in self.catalog.available_modes if str(m).strip()]
         if not modes:
             self.modeBarLayout.addWidget(QtWidgets.QLabel("Режимы: (подключитесь к БД)"))
             self.modeBarLayout.addStretch(1)
@@ -270,17 +540,22 @@ class Panel(QtWidgets.QWidget):
             grid.addWidget(b, r, c)
             return b
 
+        def add_tpl_btn(text, r, c, slot):
+            b = add_btn(text, r, c, slot)
+            self.template_buttons.append(b)
+            return b
+
         # template buttons
-        add_btn("EVE TR", 0, 0, lambda: self._on_template_button("EVE TR", mode="EVE"))
-        add_btn("S",      0, 1, lambda: self._on_template_button("S", mode="S"))
-        add_btn("F прав", 0, 2, lambda: self._on_template_button("F прав", mode="F", side="прав"))
+        add_tpl_btn("EVE TR", 0, 0, lambda: self._on_template_button("EVE TR", mode="EVE"))
+        add_tpl_btn("S",      0, 1, lambda: self._on_template_button("S", mode="S"))
+        add_tpl_btn("F прав", 0, 2, lambda: self._on_template_button("F прав", mode="F", side="прав"))
         # quick connect inside the grid (extra column)
         self.btnQuickConnect = add_btn("Подключиться", 0, 3, self._quick_connect)
 
-        add_btn("EVE NEO", 1, 0, lambda: self._on_template_button("EVE NEO", mode="EVE"))
-        add_btn("F лев",   1, 1, lambda: self._on_template_button("F лев", mode="F", side="лев"))
-        add_btn("EVE IN",  2, 0, lambda: self._on_template_button("EVE IN", mode="EVE"))
-        add_btn("EVE ALL", 3, 0, lambda: self._on_template_button("EVE ALL", mode="EVE"))
+        add_tpl_btn("EVE NEO", 1, 0, lambda: self._on_template_button("EVE NEO", mode="EVE"))
+        add_tpl_btn("F лев",   1, 1, lambda: self._on_template_button("F лев", mode="F", side="лев"))
+        add_tpl_btn("EVE IN",  2, 0, lambda: self._on_template_button("EVE IN", mode="EVE"))
+        add_tpl_btn("EVE ALL", 3, 0, lambda: self._on_template_button("EVE ALL", mode="EVE"))
         add_btn("Выгрузить КП", 4, 0, self._export_kp)
         add_btn("КП ИВЛ", 5, 0, self._kp_ivl)
         add_btn("КП расх", 5, 1, self._kp_raskh)
@@ -295,34 +570,213 @@ class Panel(QtWidgets.QWidget):
         return f'postgresql+psycopg://{self.userEdit.text()}:{self.pwEdit.text()}@{self.hostEdit.text()}:{self.portEdit.text()}/{self.dbEdit.text()}'
 
     def connect_db(self) -> bool:
+        from sqlalchemy import create_engine, text
+        from catalog_async import AsyncCatalogDb
+        self._close_async_db()
         try:
             url = self._make_url()
             self.engine = create_engine(url, pool_pre_ping=True)
             with self.engine.connect() as conn:
                 conn.execute(text("SELECT 1"))
-            self.inspector = inspect(self.engine)
-            self.status.setText("Соединение установлено, загрузка данных…")
-
-            self._load_modes()
-            self._detect_tin_columns()
-            self._preload_all_db()
-            self._preload_templates()
-
-            self._rebuild_mode_strip()
-            if self.available_modes:
-                self.set_mode(self.available_modes[0])
-            else:
-                self.set_mode("EVE")
-
-            self.status.setText(f"Готово. REF: {self.tin_ref_col}, Описание: {self.tin_desc_col}.")
-            self._update_connection_buttons(connected=True)
-            return True
         except Exception as e:
             self.engine = None
             self.status.setText(f"Ошибка подключения: {e}")
             self._update_connection_buttons(connected=False)
             return False
 
+        self.status.setText("Соединение установлено, загрузка данных…")
+        self._update_connection_buttons(connected=True)
+        self._async_db = AsyncCatalogDb(self._conninfo())
+        catalog = Catalog(self.engine)
+        path = self._snapshot_path()
+        if self.catalog.snapshot_path == path:
+            catalog.copy_from(self.catalog)
+        elif load_snapshot(path, catalog):
+            self._show_catalog(catalog)
+        catalog.snapshot_path = path
+        self._start_loader(catalog)
+        self._start_listener()
+        return True
+
+    def refresh_catalog(self, tables: Optional[Set[str]] = None):
+        """Подтянуть изменения каталога без переподключения; сводка не трогается.
+
+        tables — проверить только эти таблицы (например, названные в NOTIFY).
+        """
+        if self.engine is None or self._is_loading():
+            return
+        catalog = Catalog(self.engine)
+        catalog.copy_from(self.catalog)
+        self.status.setText("Обновление каталога…")
+        self._start_loader(catalog, tables)
+
+    # ---- push invalidation ----
+    def _conninfo(self) -> str:
+        # plain libpq URL for the psycopg connections that bypass SQLAlchemy
+        return self.engine.url.set(drivername="postgresql").render_as_string(hide_password=False)
+
+    def _start_listener(self):
+        self._stop_listener()
+        thread = QtCore.QThread(self)
+        listener = CatalogListener(self._conninfo())
+        listener.moveToThread(thread)
+        listener.notified.connect(self._on_catalog_notified)
+        listener.finished.connect(thread.quit)
+        thread.started.connect(listener.run)
+        thread.finished.connect(thread.deleteLater)
+        thread.worker = listener  # keeps the listener alive until its thread is gone, even after _stop_listener
+        self._listener, self._listener_thread = listener, thread
+        thread.start()
+
+    def _stop_listener(self, wait: bool = False):
+        if self._listener is None:
+            return
+        self._listener.stop()
+        if wait:
+            self._listener_thread.quit()
+            self._listener_thread.wait(2000)
+        self._listener = None
+        self._listener_thread = None
+
+    def _on_catalog_notified(self, table: str):
+        if self.engine is None or table not in SOURCE_TABLES:
+            return
+        # a burst of writes (bulk edit, several dialogs) turns into one refresh
+        self._notified_tables.add(table)
+        self._notify_timer.start()
+
+    def _on_notify_timer(self):
+        if self._is_loading():
+            self._notify_timer.start()
+            return
+        tables, self._notified_tables = self._notified_tables, set()
+        if tables:
+            self.refresh_catalog(tables)
+
+    def _snapshot_path(self) -> str:
+        return snapshot_path(self.hostEdit.text(), self.portEdit.text(), self.dbEdit.text())
+
+    def _load_snapshot(self):
+        catalog = Catalog()
+        if not load_snapshot(self._snapshot_path(), catalog):
+            return
+        self._show_catalog(catalog)
+        saved = datetime.fromtimestamp(catalog.snapshot_time) if catalog.snapshot_time else None
+        self.status.setText(
+            "Каталог загружен из локального снимка" + (f" от {saved:%d.%m.%Y %H:%M}" if saved else "")
+            + ". Подключитесь к БД для проверки актуальности."
+        )
+
+    def _show_catalog(self, catalog: Catalog):
+        self.catalog = catalog
+        self._on_modes_ready(catalog)
+        self._on_tables_ready(catalog)
+        self._start_indexer(catalog)
+
+    def _start_loader(self, catalog: Catalog, tables: Optional[Set[str]] = None):
+        self._cancel_loader()
+        self.catalog = catalog
+        for b in self.template_buttons:
+            b.setEnabled(False)
+
+        thread = QtCore.QThread(self)
+        loader = CatalogLoader(catalog, tables)
+        loader.moveToThread(thread)
+        loader.stage.connect(self._on_load_stage)
+        loader.modes_ready.connect(self._on_modes_ready)
+        loader.tables_ready.connect(self._on_tables_ready)
+        loader.templates_ready.connect(self._on_templates_ready)
+        loader.failed.connect(self._on_load_failed)
+        loader.finished.connect(self._on_load_finished)
+        loader.finished.connect(thread.quit)
+        thread.started.connect(loader.run)
+        thread.finished.connect(thread.deleteLater)
+
+        self._loader, self._loader_thread = loader, thread
+        self.btnRefresh.setEnabled(False)
+        thread.start()
+
+    def _cancel_loader(self):
+        # the running query is not interrupted, the worker just stops at the next stage
+        if self._loader is not None:
+            self._loader.cancel()
+            self._stale_loaders.append(self._loader)
+        self._loader = None
+        self._loader_thread = None
+
+    def _start_indexer(self, catalog: Catalog):
+        # search indexes are rebuilt off the loader, so a NOTIFY arriving meanwhile is not held up
+        if catalog.search_indexes_ready():
+            return
+        if self._indexer is not None:
+            running, built_catalog, built_tin = self._indexer
+            if running.is_alive() and built_catalog is catalog and built_tin is catalog.tin_index:
+                return   # already being built for this data
+        thread = threading.Thread(target=catalog.ensure_search_indexes, name="catalog-search-index", daemon=True)
+        self._indexer = (thread, catalog, catalog.tin_index)
+        thread.start()
+
+    def _is_loading(self) -> bool:
+        return self._loader is not None
+
+    def _on_load_stage(self, catalog: Catalog, msg: str):
+        if catalog is not self.catalog: return
+        self.status.setText(msg)
+
+    def _on_modes_ready(self, catalog: Catalog):
+        if catalog is not self.catalog: return
+        self._rebuild_mode_strip()
+        modes = catalog.available_modes
+        if self.current_mode in modes:
+            self.set_mode(self.current_mode, self.side_filter)
+        else:
+            self.set_mode(modes[0] if modes else "EVE")
+
+    def _on_tables_ready(self, catalog: Catalog):
+        if catalog is not self.catalog: return
+        self._rebuild_left()
+
+    def _on_templates_ready(self, catalog: Catalog):
+        if catalog is not self.catalog: return
+        for b in self.template_buttons:
+            b.setEnabled(True)
+
+    def _on_load_failed(self, catalog: Catalog, msg: str):
+        if catalog is not self.catalog: return
+        self.status.setText(f"Ошибка загрузки данных: {msg}")
+
+    def _on_load_finished(self, catalog: Catalog):
+        self._stale_loaders = [l for l in self._stale_loaders if l.catalog is not catalog]
+        if catalog is not self.catalog: return
+        self._loader = None
+        self._loader_thread = None
+        self._start_indexer(catalog)
+        for b in self.template_buttons:
+            b.setEnabled(True)
+        self.btnRefresh.setEnabled(self.engine is not None)
+        if catalog.cancelled or self.status.text().startswith("Ошибка"):
+            return
+        if catalog.templates_error:
+            self.status.setText(catalog.templates_error)
+        elif catalog.snapshot_time and not catalog.last_changed:
+            self.status.setText(f"Готово (каталог не изменился). REF: {catalog.tin_ref_col}, Описание: {catalog.tin_desc_col}.")
+        elif catalog.snapshot_time:
+            self.status.setText(f"Готово, обновлено таблиц: {len(catalog.last_changed)}. "
+                                f"REF: {catalog.tin_ref_col}, Описание: {catalog.tin_desc_col}.")
+        else:
+            self.status.setText(f"Готово. REF: {catalog.tin_ref_col}, Описание: {catalog.tin_desc_col}.")
+
+    def closeEvent(self, event):
+        self._stop_listener(wait=True)
+        self._close_async_db()
+        self._cancel_loader()
+        # worker threads are children of the window and must not outlive it: a cancelled loader
+        # (this one or an earlier one) stops after its current query, a КП is written to the end
+        for thread in self.findChildren(QtCore.QThread):
+            thread.quit()
+            thread.wait()
+        super().closeEvent(event)
+
     def _update_connection_buttons(self, connected: bool):
         # top-right button
         if connected:
@@ -338,226 +792,63 @@ class Panel(QtWidgets.QWidget):
                 self.btnQuickConnect.setText("Подключиться")
                 self.btnQuickConnect.setEnabled(True)
 
-    def _load_modes(self):
-        self.available_modes = ["EVE", "S", "F"]
-        if self.engine is None:
-            return
-        try:
-            cols = [c['name'] for c in self.inspector.get_columns(MODES_TABLE)]
-            if not cols:
-                return
-            def find(col_names: List[str]) -> Optional[str]:
-                s = {n.lower(): n for n in cols}
-                for name in col_names:
-                    if name.lower() in s: return s[name.lower()]
-                for c in cols:
-                    if c.lower().replace(" ", "") in {n.lower().replace(" ", "") for n in col_names}:
-                        return c
-                return None
-            mode_col = find([MODES_COL])
-            if not mode_col:
-                return
-            sql = f'''
-                SELECT DISTINCT {qident(mode_col)} AS mode
-                FROM {qident(MODES_TABLE)}
-                WHERE {qident(mode_col)} IS NOT NULL AND trim({qident(mode_col)}::text) <> ''
-                ORDER BY {qident(mode_col)}
-            '''
-            modes: List[str] = []
-            with self.engine.connect() as conn:
-                for (m,) in conn.execute(text(sql)):
-                    s = str(m).strip()
-                    if s and s not in modes:
-                        modes.append(s)
-            if modes:
-                self.available_modes = modes
-        except Exception:
-            pass
-
-    def _detect_tin_columns(self):
-        self.tin_ref_col = None
-        self.tin_desc_col = None
-        self.tin_pack_col = None
-        self.tin_price_list_col = None
-        self.tin_price_trimm_col = None
-
-        cols = [c['name'] for c in self.inspector.get_columns(TIN_ALL_TABLE)]
-
-        def norm(s): return (s or "").lower().replace(" ", "")
-
-        candidates = ["ref#","ref #","ref","pn","кат. №","кат.#","артикул"]
-        for c in cols:
-            n = norm(c)
-            if n in {x.replace(" ","") for x in candidates} or "ref" in n:
-                self.tin_ref_col = c; break
-        if not self.tin_ref_col and cols: self.tin_ref_col = cols[0]
-
-        for c in cols:
-            if norm(c) in ("наименованиерус","наименование","описание","описаное"):
-                self.tin_desc_col = c; break
-        if not self.tin_desc_col and len(cols)>1: self.tin_desc_col = cols[1] if len(cols)>1 else cols[0]
-
-        for c in cols:
-            if norm(c) in ("вуп-ке","вуп","упаковка","шт/уп"):
-                self.tin_pack_col = c; break
-
-        for c in cols:
-            nc = norm(c)
-            if self.tin_price_list_col is None and ("лист" in nc and "25" in nc):
-                self.tin_price_list_col = c
-            if self.tin_price_trimm_col is None and (("трм" in nc or "трим" in nc or "трмм" in nc) and "25" in nc):
-                self.tin_price_trimm_col = c
-        if self.tin_price_trimm_col:
-            candidates_trm = [c for c in cols if ("трм" in norm(c) or "трим" in norm(c) or "трмм" in norm(c)) and "25" in norm(c)]
-            for c in candidates_trm:
-                if "спец" in norm(c):
-                    self.tin_price_trimm_col = c
-                    break
-
-    def _preload_all_db(self):
-        self.table_cache.clear()
-        self.options_cache.clear()
-        self.tin_index.clear()
-        if self.engine is None: return
-        with self.engine.connect() as conn:
-            for label, table in LABEL_TO_TABLE.items():
-                rows = []
-                try:
-                    cols = has_columns(self.engine, table, ["DIV","Disc Sh","PN","Side","Сторона"])
-                    side_expr = None
-                    if cols.get("Side"):      side_expr = qident("Side")
-                    elif cols.get("Сторона"): side_expr = qident("Сторона")
-
-                    sel = f'SELECT {qident("DIV")}, {qident("Disc Sh")}, {qident("PN")}'
-                    sel += f', {side_expr} AS "SIDE"' if side_expr else ', NULL AS "SIDE"'
-                    sel += f' FROM {qident(table)}'
-
-                    for row in conn.execute(text(sel)):
-                        rows.append({
-                            "DIV": (row[0] or "").strip(),
-                            "Disc Sh": (row[1] or "").strip(),
-                            "PN": norm_ref(row[2]),
-                            "SIDE": (row[3] or "").strip() if row[3] is not None else ""
-                        })
-                except Exception:
-                    rows = []
-                self.table_cache[table] = rows
-                for mode in self.available_modes:
-                    for side in (None, "прав", "лев"):
-                        self._build_options_cache(table, mode, side)
-
-            ref_col = qident(self.tin_ref_col)
-            desc_col = qident(self.tin_desc_col)
-            pack_col = qident(self.tin_pack_col) if self.tin_pack_col else "NULL"
-            list_col = qident(self.tin_price_list_col) if self.tin_price_list_col else "NULL"
-            trm_col  = qident(self.tin_price_trimm_col) if self.tin_price_trimm_col else "NULL"
-            sel_tin = f'''
-                SELECT {ref_col} AS ref, {desc_col} AS desc_ru, {pack_col} AS pack,
-                       {list_col} AS price_list, {trm_col} AS price_trimm
-                FROM {qident(TIN_ALL_TABLE)}
-            '''
-            try:
-                for ref, desc_ru, pack, price_list, price_trimm in conn.execute(text(sel_tin)):
-                    if ref is None: continue
-                    keys = {norm_ref(ref), str(ref).strip(), digits_only(str(ref))}
-                    for k in keys:
-                        self.tin_index[k] = (
-                            str(desc_ru or ""),
-                            None if pack is None else str(pack),
-                            None if price_list is None else str(price_list),
-                            None if price_trimm is None else str(price_trimm),
-                        )
-            except Exception:
-                pass
-
-    def _build_options_cache(self, table: str, mode: str, side: Optional[str]):
-        rows = self.table_cache.get(table, [])
-        want_mode = (mode or "").strip().lower()
-        mapping: Dict[str, str] = {}
-        for r in rows:
-            div = (r.get("DIV") or "").strip().lower()
-            if div != want_mode:
-                continue
-            if side and r.get("SIDE") and (r["SIDE"].strip().lower() != side.strip().lower()):
-                continue
-            disc = r.get("Disc Sh",""); pn = r.get("PN","")
-            if disc and pn and disc not in mapping:
-                mapping[disc] = pn
-        self.options_cache[(table, mode, side)] = mapping
-
     # ============== Templates ==============
-    def _preload_templates(self):
-        self.templates.clear()
-        if self.engine is None: return
-        try:
-            cols = [c['name'] for c in self.inspector.get_columns(TEMPLATES_TABLE)]
-        except Exception:
-            self.status.setText(f'Таблица "{TEMPLATES_TABLE}" не найдена — кнопки шаблонов пропущены.')
-            return
-
-        def find(col_names: List[str]) -> Optional[str]:
-            s = {n.lower(): n for n in cols}
-            for name in col_names:
-                if name.lower() in s: return s[name.lower()]
-            for c in cols:
-                if c.lower().replace(" ", "") in {n.lower().replace(" ", "") for n in col_names}:
-                    return c
-            return None
-
-        type_col = find(["Type", "Тип"])
-        pn_col   = find(["PN", "Кат. №", "Артикул", "Ref", "REF", "REF #", "REF#"])
-        qts_col  = find(["Qts"])
-
-        if not (type_col and pn_col):
-            self.status.setText(f'В таблице "{TEMPLATES_TABLE}" не найдены столбцы Type/PN.')
-            return
-
-        sel = f'SELECT {qident(type_col)} AS t, {qident(pn_col)} AS pn'
-        if qts_col:
-            sel += f', {qident(qts_col)} AS qts'
-        sel += f' FROM {qident(TEMPLATES_TABLE)}'
-
-        try:
-            with self.engine.connect() as conn:
-                for row in conn.execute(text(sel)):
-                    t = str(row[0] or "").strip()
-                    pn = norm_ref(row[1])
-                    if not t or not pn: continue
-                    if qts_col:
-                        raw_qts = row[2]
-                        try: q = int(float(raw_qts)) if raw_qts is not None else 1
-                        except Exception: q = 1
-                    else:
-                        q = 1
-                    key = t.lower()
-                    self.templates.setdefault(key, []).append((pn, max(1, q)))
-        except Exception as e:
-            self.status.setText(f'Ошибка чтения "{TEMPLATES_TABLE}": {e}')
-
     def _on_template_button(self, type_name: str, mode: Optional[str] = None, side: Optional[str] = None):
         if mode:
             self.set_mode(mode, side)
         self._apply_template(type_name)
 
     def _apply_template(self, type_name: str):
-        if not self.templates:
-            self._preload_templates()
-        items = self.templates.get(type_name.strip().lower(), [])
+        if self._is_loading() and not self.catalog.templates:
+            self.status.setText("Шаблоны ещё загружаются…")
+            return
+        items = self.catalog.templates.get(type_name.strip().lower(), [])
         if not items:
             QtWidgets.QMessageBox.information(self, "Шаблон", f'В "{TEMPLATES_TABLE}" нет строк с Type = "{type_name}".')
             return
-        added = 0
-        for pn, qts in items:
-            added += self._add_row_by_pn(pn, qts)
+        self._add_rows_by_pn(items, on_added=lambda added, t=type_name: self._on_template_added(t, added))
+
+    def _on_template_added(self, type_name: str, added: int):
         if added:
-            self._renumber()
+            self._recalc_totals()
             self.status.setText(f'Добавлено из "{type_name}": {added} позиций (кол-во из Qts).')
         else:
             self.status.setText(f'Шаблон "{type_name}" не дал совпадений по PN.')
 
     # ============== Interactions ==============
-class Panel(QtWidgets.QWidget):
-    # ... other methods ...
+    def _rebuild_left(self):
+        # keep what the user already picked if the option survives the rebuild
+        picked = {rc.label: (rc.combo.currentText(), rc.spin.value()) for rc in self.row_controls}
+        while self.leftLayout.count():
+            item = self.leftLayout.takeAt(0)
+            w = item.widget()
+            if w: w.deleteLater()
+        self.row_controls = []
+
+        for label in self.labels:
+            table_name = LABEL_TO_TABLE.get(label)
+            options = self.catalog.options_cache.get((table_name, self.current_mode, self.side_filter)) or {}
+
+            row = QtWidgets.QWidget()
+            lay = QtWidgets.QHBoxLayout(row)
+            lay.setContentsMargins(0, 0, 0, 0)
+            lbl = QtWidgets.QLabel(label); lbl.setMinimumWidth(140)
+            combo = QtWidgets.QComboBox(); combo.addItems(list(options.keys()))
+            combo.setSizeAdjustPolicy(QtWidgets.QComboBox.AdjustToMinimumContentsLengthWithIcon)
+            spin = QtWidgets.QSpinBox(); spin.setRange(0, 9999)
+            btn = QtWidgets.QPushButton("Добавить")
+            btn.setAutoDefault(False); btn.setDefault(False)
+            btn.setEnabled(bool(options))
+            btn.clicked.connect(lambda _, l=label, c=combo, s=spin: self.add_to_summary(l, c, s))
+            if label in picked:
+                text, qty = picked[label]
+                if text in options: combo.setCurrentText(text)
+                spin.setValue(qty)
+            lay.addWidget(lbl); lay.addWidget(combo, 1); lay.addWidget(spin); lay.addWidget(btn)
+
+            self.leftLayout.addWidget(row)
+            self.row_controls.append(RowControl(label, combo, spin))
+        self.leftLayout.addStretch(1)
 
     def set_mode(self, mode: str, side: Optional[str] = None):
         m = (mode or "").strip()
@@ -570,67 +861,42 @@ class Panel(QtWidgets.QWidget):
             f"Режим: {self.current_mode}" + (f", {self.side_filter}" if self.side_filter else "")
         )
 
-    def _fetch_tin_by_pn(self, pn: str):
-        if not pn or self.engine is None or not self.tin_ref_col:
-            return ("", None, None, None)
-
-        pn_text = str(pn).strip().replace(",", ".")
-        pn_digits = digits_only(pn_text)
-
-        pn_num = None
-        try:
-            f = float(pn_text)
-            pn_num = int(f) if f.is_integer() else f
-        except Exception:
-            pn_num = None
-
-        ref = qident(self.tin_ref_col)
-        desc = qident(self.tin_desc_col)
-        pack = qident(self.tin_pack_col) if self.tin_pack_col else "NULL"
-        list_col = qident(self.tin_price_list_col) if self.tin_price_list_col else "NULL"
-        trm_col = qident(self.tin_price_trimm_col) if self.tin_price_trimm_col else "NULL"
-
-        # Optional numeric clause (built separately to avoid f-string backslash issues)
-        or_numeric = ""
-        if pn_num is not None:
-            or_numeric = (
-                "       OR ({ref}::text ~ '^\\s*\\d+(\\.\\d+)?\\s*' "
-                "AND {ref}::numeric = :pn_num)\n"
-            ).format(ref=ref)
-
-        sql = (
-            "SELECT {desc} AS desc_ru, {pack} AS pack, {list_col} AS price_list, {trm_col} AS price_trimm\n"
-            "FROM {table}\n"
-            "WHERE trim({ref}::text) = :pn_text\n"
-            "   OR regexp_replace({ref}::text, '\\\\D', '', 'g') = :pn_digits\n"
-            "{or_numeric}"
-            "LIMIT 1"
-        ).format(
-            desc=desc,
-            pack=pack,
-            list_col=list_col,
-            trm_col=trm_col,
-            table=qident(TIN_ALL_TABLE),
-            ref=ref,
-            or_numeric=or_numeric,
-        )
-
-        try:
-            with self.engine.connect() as conn:
-                params = {"pn_text": pn_text, "pn_digits": pn_digits}
-                if pn_num is not None:
-                    params["pn_num"] = pn_num
-                row = conn.execute(text(sql), params).fetchone()
-                if row:
-                    return (
-                        str(row[0] or ""),
-                        None if row[1] is None else str(row[1]),
-                        None if row[2] is None else str(row[2]),
-                        None if row[3] is None else str(row[3]),
-                    )
-        except Exception:
-            pass
-        return ("", None, None, None)
+    def _close_async_db(self):
+        db, self._async_db = self._async_db, None
+        if db is not None:
+            db.close()
+        # lookups that were still waiting on that connection are answered from the index
+        for batch in list(self._pending_rows):
+            self._on_rows_fetched(batch, None, None)
+
+    def _on_pn_search(self, query: str):
+        self.pnResults.clear()
+        # indexes are only ever built by the indexer thread; until they are ready the previous ones are searched
+        ready = self.catalog.search_indexes_ready()
+        if not ready and not self._is_loading():
+            self._start_indexer(self.catalog)
+        hits = self.catalog.search_pn(query, limit=50, build=False) if query.strip() else []
+        if len(hits) < 50:
+            seen = {ref for ref, _ in hits}
+            hits += [h for h in self.catalog.search_desc(query, limit=50, build=False) if h[0] not in seen][:50 - len(hits)]
+        for ref, (desc, _pack, list_price, _trm) in hits:
+            item = QtWidgets.QListWidgetItem(f"{ref}  —  {desc}  ({fmt_money(list_price)})")
+            item.setData(QtCore.Qt.UserRole, ref)
+            self.pnResults.addItem(item)
+        if hits:
+            self.pnResults.setCurrentRow(0)
+        elif query.strip() and not ready:
+            self.status.setText("Индекс поиска ещё строится…")
+        self.pnResults.setVisible(bool(hits))
+
+    def _add_pn_search_result(self, item: Optional[QtWidgets.QListWidgetItem] = None):
+        item = item if isinstance(item, QtWidgets.QListWidgetItem) else self.pnResults.currentItem()
+        if item is None:
+            return
+        pn = item.data(QtCore.Qt.UserRole)
+        self._add_row_by_pn(pn, 1, on_added=self._on_rows_added)
+        self.pnSearchEdit.clear()
+        self.status.setText(f"Добавлено по поиску: {pn}")
 
     def add_to_summary(self, label: str, combo: QtWidgets.QComboBox, spin: QtWidgets.QSpinBox):
         option = combo.currentText()
@@ -638,153 +904,156 @@ class Panel(QtWidgets.QWidget):
         pn = ""
         table_name = LABEL_TO_TABLE.get(label)
         if table_name:
-            pn_map = self.options_cache.get((table_name, self.current_mode, self.side_filter)) or {}
+            pn_map = self.catalog.options_cache.get((table_name, self.current_mode, self.side_filter)) or {}
             pn = pn_map.get(option, "")
-        self._add_row_by_pn(pn, qty)
+        self._add_row_by_pn(pn, qty, on_added=self._on_rows_added)
         spin.setValue(0)
-        self._renumber()
-        self._recalc_totals()
-
-    def _add_row_by_pn(self, pn: str, qty: int = 1) -> int:
-        if not pn:
-            return 0
-        desc, pack, price_list_s, price_trm_s = self._fetch_tin_by_pn(pn)
-        if not desc:
-            hit = self.tin_index.get(pn) or self.tin_index.get(norm_ref(pn)) or self.tin_index.get(digits_only(pn))
-            if hit:
-                desc, pack, price_list_s, price_trm_s = hit
 
-        list_price = parse_money(price_list_s)
-        trm_base   = parse_money(price_trm_s)
-        trm_display = trm_base * self.logisticsSpin.value() if trm_base is not None else None
+    def _on_rows_added(self, _added: int):
+        self._recalc_totals()
 
-        self._building_table = True
+    def _lookup_index(self, batch: PendingRows):
+        """Сначала загруженный индекс; промахи (или все PN с «Цены напрямую из БД») — в batch.missing."""
+        index = self.catalog.tin_index
+        wanted = list(dict.fromkeys(pn for pn, _ in batch.items))
+        if not self.chkLookupDb.isChecked():
+            for pn in wanted:
+                hit = index.find(pn)
+                if hit: batch.found[pn] = hit
+            self._lookup_stats["index"] += len(batch.found)
+        batch.missing = [pn for pn in wanted if pn not in batch.found]
+
+    def _on_rows_fetched(self, batch: PendingRows, fetched: Optional[TinIndex], error: Optional[BaseException] = None):
+        if batch.ready:
+            return
+        if error is not None:
+            self.status.setText(f"Ошибка поиска PN в БД: {error}")
+        stats = self._lookup_stats
+        index = self.catalog.tin_index
+        from_db = self.chkLookupDb.isChecked()
+        for pn in batch.missing:
+            rec = fetched.find(pn) if fetched is not None else None
+            if rec and rec[0]:
+                stats["db"] += 1
+            elif from_db and index.find(pn):
+                rec = index.find(pn)
+                stats["index"] += 1
+            else:
+                rec = ("", None, None, None)
+                # the DB did not answer: the PN may well exist, so it is not counted as not found
+                stats["failed" if error is not None else "miss"] += 1
+            batch.found[pn] = rec
+        batch.ready = True
+        self._flush_pending_rows()
+
+    def _update_lookup_label(self):
+        s = self._lookup_stats
+        waiting = sum(len(b.items) for b in self._pending_rows)
+        self.lookupLabel.setText(f"Поиск PN — индекс: {s['index']}, БД: {s['db']}, не найдено: {s['miss']}"
+                                 + (f", ошибка БД: {s['failed']}" if s['failed'] else "")
+                                 + (f", ждут БД: {waiting}" if waiting else ""))
+
+    def _add_row_by_pn(self, pn: str, qty: int = 1, on_added: Optional[Callable[[int], None]] = None):
+        self._add_rows_by_pn([(pn, qty)], on_added)
+
+    def _add_rows_by_pn(self, items: List[Tuple[str, int]], on_added: Optional[Callable[[int], None]] = None):
+        """Добавить строки в сводку. Позиции не из индекса ищутся в БД корутиной, не блокируя окно;
+        on_added(число строк) вызывается, когда строки вставлены."""
+        batch = PendingRows([(pn, qty) for pn, qty in items if pn], on_added)
+        self._pending_rows.append(batch)
+        self._lookup_index(batch)
+        if batch.missing and self._async_db is not None:
+            future = self._async_db.submit(self._async_db.fetch_tin(self.catalog, batch.missing))
+            self._async_results.watch(future, lambda fetched, err, b=batch: self._on_rows_fetched(b, fetched, err))
+            self._update_lookup_label()
+        else:
+            self._on_rows_fetched(batch, None)
+
+    def _flush_pending_rows(self):
+        ready = 0
+        for batch in self._pending_rows:
+            if not batch.ready: break
+            ready += len(batch.items)
+        # a few rows go in as plain inserts, so the view keeps its selection
+        with self._bulk_summary() if ready >= BULK_ROWS else nullcontext():
+            while self._pending_rows and self._pending_rows[0].ready:
+                batch = self._pending_rows.popleft()
+                self._insert_rows(batch.items, batch.found)
+                if batch.on_added:
+                    batch.on_added(len(batch.items))
+        self._update_lookup_label()
+
+    @contextmanager
+    def _bulk_summary(self):
+        """Массовая правка сводки: без перерисовки, сортировки, сигналов и пересчёта итогов
+        на каждую строку; в конце одна перерисовка и один пересчёт."""
+        if self._bulk_depth:
+            yield
+            return
+        view = self.table
+        sorting = view.isSortingEnabled()
+        view.setSortingEnabled(False)
+        view.setUpdatesEnabled(False)
+        self._bulk_depth += 1
         try:
-            row = self.table.rowCount()
-            self.table.insertRow(row)
-            self.table.setItem(row, self.COL_NO, QtWidgets.QTableWidgetItem(str(row+1)))
-            self.table.setItem(row, self.COL_PN, QtWidgets.QTableWidgetItem(pn))
-            self.table.setItem(row, self.COL_DESC, QtWidgets.QTableWidgetItem(desc))
-            self.table.setItem(row, self.COL_QTY, QtWidgets.QTableWidgetItem(str(max(1, qty))))
-            self.table.setItem(row, self.COL_CTRL, QtWidgets.QTableWidgetItem("1"))
-            self.table.setItem(row, self.COL_PACK, QtWidgets.QTableWidgetItem("" if pack is None else str(pack)))
-
-            it_list = QtWidgets.QTableWidgetItem(fmt_money(list_price))
-            it_list.setData(self.USERROLE_LIST_PRICE, list_price if list_price is not None else 0.0)
-            self.table.setItem(row, self.COL_PRICE_LIST, it_list)
-
-            it_trm = QtWidgets.QTableWidgetItem(fmt_money(trm_display))
-            it_trm.setData(self.USERROLE_BASE_TRIMM, trm_base if trm_base is not None else 0.0)
-            self.table.setItem(row, self.COL_PRICE_TRIMM, it_trm)
+            with self.summaryModel.bulk():
+                yield
         finally:
-            self._building_table = False
-        return 1
+            self._bulk_depth -= 1
+            view.setSortingEnabled(sorting)
+            view.setUpdatesEnabled(True)
+            self._recalc_totals(full=True)
 
-    def _renumber(self):
-        for r in range(self.table.rowCount()):
-            self.table.setItem(r, self.COL_NO, QtWidgets.QTableWidgetItem(str(r+1)))
+    def _insert_rows(self, items: List[Tuple[str, int]], found: Dict[str, TinRecord]):
+        self.summaryModel.append_lines(lines_from_records(items, found))
 
     def delete_selected(self):
-        rows = sorted({ix.row() for ix in self.table.selectedIndexes()}, reverse=True)
-        for r in rows:
-            self.table.removeRow(r)
-        self._renumber()
+        rows = {ix.row() for ix in self.table.selectionModel().selectedIndexes()}
+        with self._bulk_summary() if len(rows) >= BULK_ROWS else nullcontext():
+            self.summaryModel.remove_rows(rows)
         self._recalc_totals()
 
     def _clear_cat_numbers(self):
-        col = self.COL_PN
-        for r in range(self.table.rowCount()):
-            self.table.setItem(r, col, QtWidgets.QTableWidgetItem(""))
+        self.summaryModel.clear_pns()   # one dataChanged for the column, no bulk mode needed
 
     def _move_row_with_cat_down(self):
-        col = self.COL_PN
-        for r in range(self.table.rowCount()-1):
-            it = self.table.item(r, col)
-            if it and it.text().strip():
-                self.table.insertRow(r+2)
-                for c in range(self.table.columnCount()):
-                    src = self.table.takeItem(r, c)
-                    self.table.setItem(r+2, c, src)
-                self.table.removeRow(r)
+        pns = self.quote.pns
+        for r in range(len(pns) - 1):
+            if pns[r].strip():
+                self.summaryModel.move_row(r, r + 2)
                 break
-        self._renumber()
         self._recalc_totals()
 
-    def _on_table_item_changed(self, _: QtWidgets.QTableWidgetItem):
-        if self._building_table: return
+    def _on_summary_changed(self, *_):
         self._recalc_totals()
 
-    def _on_logistics_changed(self, _val: float):
-        self._building_table = True
-        try:
-            L = self.logisticsSpin.value()
-            for r in range(self.table.rowCount()):
-                it_trm = self.table.item(r, self.COL_PRICE_TRIMM)
-                if not it_trm: continue
-                base = it_trm.data(self.USERROLE_BASE_TRIMM)
-                base = float(base) if base is not None else 0.0
-                disp = base * L if base else 0.0
-                it_trm.setText(fmt_money(disp if base else None))
-        finally:
-            self._building_table = False
-        self._recalc_totals()
+    def _schedule_reprice(self, *_):
+        # not restarted while pending: a continuous drag still repaints every frame
+        if not self._reprice_timer.isActive():
+            self._reprice_timer.start()
 
-    def _recalc_totals(self):
-        disc = 1.0 - (self.discountSpin.value() / 100.0)
-        L = self.logisticsSpin.value()
-        K = self.kursSpin.value()
-
-        list_total = 0.0
-        trm_total  = 0.0
-        for r in range(self.table.rowCount()):
-            try:
-                qty = int(float((self.table.item(r, self.COL_QTY).text() or "0").replace(",", ".")))
-            except Exception:
-                qty = 0
-            it_list = self.table.item(r, self.COL_PRICE_LIST)
-            list_pu = float(it_list.data(self.USERROLE_LIST_PRICE) or 0.0) if it_list else 0.0
-            it_trm = self.table.item(r, self.COL_PRICE_TRIMM)
-            trm_base = float(it_trm.data(self.USERROLE_BASE_TRIMM) or 0.0) if it_trm else 0.0
-
-            list_total += qty * list_pu
-            trm_total  += qty * trm_base * L
-
-        total_after_disc = list_total * disc
-        total_after_disc_conv = total_after_disc * K
-        trm_total_conv = trm_total * K
-
-        if trm_total_conv > 0:
-            margin = (total_after_disc_conv - trm_total_conv) / trm_total_conv
-            margin_text = f"Маржа: {margin*100:.2f}%"
-        else:
-            margin_text = "Маржа: —"
+    def _reprice(self):
+        """Скидка/логистика/курс изменились: движок пересчитывает цены за единицу, столбец ТРИММ — одним dataChanged."""
+        self.quote.set_pricing(discount=self.discountSpin.value(), logistics=self.logisticsSpin.value(),
+                               kurs=self.kursSpin.value())
+        self.summaryModel.prices_changed()
+        self._recalc_totals()
 
-        self.lbl_total.setText(f"Итого: {total_after_disc_conv:.2f}")
-        self.lbl_margin.setText(margin_text)
+    def _recalc_totals(self, full: bool = False):
+        """Итого и маржа из текущих сумм сводки; full — сначала пересчитать суммы по всем строкам."""
+        if self._bulk_depth:
+            return   # _bulk_summary recalculates once on exit
+        if full:
+            self.quote.recompute_sums()
+        elif DEBUG:
+            self.quote.check_sums()
+        totals = self.quote.totals()
+        self.lbl_total.setText(f"Итого: {fmt_minor(totals.total)}")
+        self.lbl_margin.setText(f"Маржа: {totals.margin*100:.2f}%" if totals.margin is not None else "Маржа: —")
 
     # ============== Export KP ==============
     def _export_kp(self):
-        if openpyxl is None:
-            QtWidgets.QMessageBox.critical(self, "Выгрузить КП",
-                "Модуль openpyxl не установлен. Установите его:\n\npip install openpyxl")
-            return
-
-        items: List[Tuple[str, str, int, float]] = []
-        for r in range(self.table.rowCount()):
-            pn = (self.table.item(r, self.COL_PN).text().strip()
-                  if self.table.item(r, self.COL_PN) else "")
-            desc = (self.table.item(r, self.COL_DESC).text().strip()
-                    if self.table.item(r, self.COL_DESC) else "")
-            qty_text = (self.table.item(r, self.COL_QTY).text()
-                        if self.table.item(r, self.COL_QTY) else "")
-            try:
-                qty = int(float((qty_text or "0").replace(",", ".")))
-            except Exception:
-                qty = 0
-            it_list = self.table.item(r, self.COL_PRICE_LIST)
-            unit_price = float(it_list.data(self.USERROLE_LIST_PRICE) or 0.0) if it_list else 0.0
-            if not (pn or desc or qty or unit_price): continue
-            items.append((pn, desc, qty, unit_price))
+        items = self.quote.export_rows()
 
         if not items:
             QtWidgets.QMessageBox.information(self, "Выгрузить КП", "Нет данных в сводке для выгрузки.")
@@ -796,44 +1065,57 @@ class Panel(QtWidgets.QWidget):
             QtWidgets.QMessageBox.critical(self, "Выгрузить КП",
                 f"Не найден шаблон: {tpl_path}\nПоложите template.xlsx рядом с приложением.")
             return
-        out_path = os.path.join(base_dir, f"КП_{datetime.now():%Y%m%d_%H%M%S}.xlsx")
-
-        try:
-            wb = openpyxl.load_workbook(tpl_path, keep_vba=False)
-        except Exception as e:
-            QtWidgets.QMessageBox.critical(self, "Выгрузить КП", f"Не удалось открыть шаблон:\n{e}")
-            return
-
-        ws = wb.active
-
-        def write_line(row_index: int, rec: Tuple[str, str, int, float]):
-            pn, desc, qty, unit_price = rec
-            ws.cell(row=row_index, column=2, value=pn)
-            ws.cell(row=row_index, column=3, value=desc)
-            ws.cell(row=row_index, column=4, value=qty)
-            ws.cell(row=row_index, column=5, value=unit_price)
-            ws.cell(row=row_index, column=6, value=f"=E{row_index}*D{row_index}")
-
-        write_line(5, items[0])
-        start_row = 22
-        for i, rec in enumerate(items[1:], start=0):
-            write_line(start_row + i, rec)
-
-        try:
-            wb.save(out_path)
-        except Exception as e:
-            QtWidgets.QMessageBox.critical(self, "Выгрузить КП", f"Не удалось сохранить файл:\n{e}")
-            return
-
+        out_path = self._kp_out_path(base_dir)
+
+        from kp_export import KpTemplate
+        if self._kp_template is None or self._kp_template.path != tpl_path:
+            self._kp_template = KpTemplate(tpl_path)
+
+        # the sheet is written off the GUI thread: the summary stays editable, another export can start meanwhile
+        thread = QtCore.QThread(self)
+        exporter = KpExporter(self._kp_template, items, out_path)
+        exporter.moveToThread(thread)
+        exporter.progress.connect(self._on_export_progress)
+        exporter.saved.connect(self._on_export_saved)
+        exporter.failed.connect(self._on_export_failed)
+        exporter.finished.connect(self._on_export_finished)
+        exporter.finished.connect(thread.quit)
+        thread.started.connect(exporter.run)
+        thread.finished.connect(thread.deleteLater)
+        self._exports.append((exporter, thread))
+        self.status.setText(f"Выгрузка КП: {os.path.basename(out_path)}…")
+        thread.start()
+
+    def _kp_out_path(self, base_dir: str) -> str:
+        # exports started within the same second get _2, _3, ...
+        stem = os.path.join(base_dir, f"КП_{datetime.now():%Y%m%d_%H%M%S}")
+        busy = {e.out_path for e, _ in self._exports}
+        out_path, n = stem + ".xlsx", 1
+        while out_path in busy or os.path.exists(out_path):
+            n += 1
+            out_path = f"{stem}_{n}.xlsx"
+        return out_path
+
+    def _on_export_progress(self, exporter: KpExporter, done: int, total: int):
+        self.status.setText(f"Выгрузка КП: {os.path.basename(exporter.out_path)} — {done}/{total} строк…")
+
+    def _on_export_saved(self, exporter: KpExporter):
+        out_path = exporter.out_path
+        self.status.setText(f"КП готово: записано {len(exporter.items)} строк(и) в файл {out_path}")
         try:
+            import subprocess
             if sys.platform.startswith("win"): os.startfile(out_path)
             elif sys.platform == "darwin": subprocess.Popen(["open", out_path])
             else: subprocess.Popen(["xdg-open", out_path])
         except Exception:
             pass
 
-        QtWidgets.QMessageBox.information(self, "Выгрузить КП",
-            f"Готово: записано {len(items)} строк(и) в файл:\n{out_path}")
+    def _on_export_failed(self, exporter: KpExporter, msg: str):
+        self.status.setText(f"КП не выгружено: {os.path.basename(exporter.out_path)}")
+        QtWidgets.QMessageBox.critical(self, "Выгрузить КП", msg)
+
+    def _on_export_finished(self, exporter: KpExporter):
+        self._exports = [(e, t) for e, t in self._exports if e is not exporter]
 
     # ============== Other actions ==============
     def _kp_ivl(self):
@@ -903,6 +1185,7 @@ class Panel(QtWidgets.QWidget):
             "PGPASSWORD": self.pwEdit.text(),
         })
         try:
+            import subprocess
             subprocess.Popen([sys.executable, tool], env=env)
         except Exception as e:
             QtWidgets.QMessageBox.critical(self, "Редактировать значения/таблицы", f"Не удалось запустить редактор:\n{e}")
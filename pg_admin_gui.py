@@ -7,6 +7,9 @@ from sqlalchemy import create_engine, text, Table, MetaData, inspect, select
 from sqlalchemy.engine import Engine
 from sqlalchemy import Integer, Float, Boolean, Text, LargeBinary, Date, DateTime, Time, Numeric
 
+# the channel MAG Config (mag_panel.py) listens on to pick up catalog edits at once
+from catalog_addons import NOTIFY_CHANNEL
+
 # Optional (ttkbootstrap) – light theme only
 try:
     from ttkbootstrap import Style
@@ -17,6 +20,9 @@ APP_TITLE = "PostgreSQL Администратор (Десктоп)"
 DEFAULTS = {"host": "127.0.0.1", "port": "5432", "database": "postgres", "user": "postgres", "password": ""}
 
 # ----------------- Utility -----------------
+def notify_changed(conn, table: Table):
+    conn.execute(text("SELECT pg_notify(:ch, :t)"), {"ch": NOTIFY_CHANNEL, "t": table.name})
+
 def coerce_value(col, raw: str):
     if raw == "" or raw is None:
         return None
@@ -76,6 +82,7 @@ class EditDialog(tk.Toplevel):
         try:
             with self.engine.begin() as conn:
                 conn.execute(self.table.update().where(self.table.c[self.pk_col] == self.pk_value).values(**payload))
+                notify_changed(conn, self.table)
             self.destroy()
         except Exception as e:
             messagebox.showerror(APP_TITLE, f"Не удалось сохранить изменения:\n{e}")
@@ -122,6 +129,7 @@ class BulkUpdateDialog(tk.Toplevel):
                 conn.execute(
                     self.table.update().where(self.table.c[self.pk_col].in_(self.pk_values)).values({colname: new_value})
                 )
+                notify_changed(conn, self.table)
             self.destroy()
         except Exception as e:
             messagebox.showerror(APP_TITLE, f"Не удалось применить массовое изменение:\n{e}")
@@ -176,6 +184,7 @@ class AddDialog(tk.Toplevel):
                         conn.execute(self.table.insert().values(**payload))
                 else:
                     conn.execute(self.table.insert().values(**payload))
+                notify_changed(conn, self.table)
             self.destroy()
         except Exception as e:
             messagebox.showerror(APP_TITLE, f"Не удалось добавить запись:\n{e}")
@@ -451,6 +460,7 @@ class App(tk.Tk):
         try:
             with self.engine.begin() as conn:
                 conn.execute(table.delete().where(table.c[self.current_pk].in_(pk_vals)))
+                notify_changed(conn, table)
             self.refresh_rows()
         except Exception as e:
             messagebox.showerror(APP_TITLE, f"Не удалось удалить строки:\n{e}")
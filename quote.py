@@ -0,0 +1,232 @@
+# -*- coding: utf-8 -*-
+"""Расчёт КП без Qt: строки сводки по столбцам, итоги, маржа и цены строк.
+
+Панель показывает QuoteEngine через SummaryModel; пакетные скрипты и бенчмарки
+считают те же цифры без окна.
+
+Деньги — целые копейки. Цена за единицу после скидки/логистики/курса округляется
+до копейки (половина — вверх), сумма строки — кол-во × цена за единицу, итог — сумма
+строк: так же, как считается счёт.
+"""
+from array import array
+from dataclasses import dataclass
+from decimal import Decimal, ROUND_HALF_UP
+from itertools import repeat
+from operator import add, floordiv, mul
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from catalog import TinRecord
+
+MINOR = 100            # копеек в рубле
+FACTOR_ONE = 10000     # множители хранятся с 4 знаками, как в полях «Логистика» и «Курс»
+FACTOR_DEN = FACTOR_ONE * FACTOR_ONE
+
+class QuoteLine(NamedTuple):
+    pn: str
+    desc: str
+    qty: int
+    pack: Optional[str]
+    list_price: Optional[float]
+    trimm_price: Optional[float]   # base TRIMM, without logistics
+
+@dataclass
+class QuoteTotals:
+    """Итоги КП; суммы в копейках."""
+    list_total: int          # Σ кол-во × цена
+    total: int               # со скидкой, по курсу — «Итого»
+    trimm_total: int         # Σ кол-во × ТРИММ × логистика × курс
+    margin: Optional[float]  # (итого − ТРИММ) / ТРИММ; None, если ТРИММ нулевой
+
+def fixed(x, places: int) -> int:
+    """Число -> целое с places знаками после запятой (половина — вверх): fixed(12.345, 2) == 1235."""
+    return int(Decimal(str(x)).scaleb(places).quantize(Decimal(1), ROUND_HALF_UP))
+
+def to_minor(price: Optional[float]) -> Optional[int]:
+    """Цена -> копейки. Цены из каталога обычно уже с двумя знаками, для них хватает round()."""
+    if price is None: return None
+    minor = round(price * MINOR)
+    return minor if minor / MINOR == price else fixed(price, 2)
+
+def fmt_minor(minor: Optional[int]) -> str:
+    if minor is None: return ""
+    sign = "-" if minor < 0 else ""
+    rub, kop = divmod(abs(minor), MINOR)
+    return f"{sign}{rub}.{kop:02d}"
+
+def scale(values: Iterable[int], num: int, den: int) -> Iterable[int]:
+    """Каждое значение × num / den с округлением половины вверх, циклом на уровне C (цены не отрицательные, den чётный)."""
+    if num == den:
+        return values
+    return map(floordiv, map(add, map(mul, values, repeat(num)), repeat(den // 2)), repeat(den))
+
+def scale_one(value: int, num: int, den: int) -> int:
+    return (value * num + den // 2) // den
+
+def lines_from_records(items: Iterable[Tuple[str, int]], found: Dict[str, TinRecord]) -> List[QuoteLine]:
+    """(pn, кол-во) + найденные записи EVE TIN ALL -> строки КП (кол-во не меньше 1)."""
+    lines = []
+    for pn, qty in items:
+        desc, pack, list_price, trimm_price = found[pn]
+        lines.append(QuoteLine(pn, desc or "", max(1, qty), pack, list_price, trimm_price))
+    return lines
+
+def contiguous_runs(rows: Iterable[int]) -> List[Tuple[int, int]]:
+    """Номера строк -> отрезки (first, last) снизу вверх: удаление по порядку не сдвигает следующие."""
+    rows = sorted(set(rows), reverse=True)
+    runs = []
+    i = 0
+    while i < len(rows):
+        last = first = rows[i]
+        i += 1
+        while i < len(rows) and rows[i] == first - 1:
+            first = rows[i]
+            i += 1
+        runs.append((first, last))
+    return runs
+
+class QuoteEngine:
+    """Строки КП по столбцам и вся арифметика цен.
+
+    Кол-во и цены — array('q') в копейках; отсутствующая цена хранится нулём с флагом
+    в has_list/has_trimm. Цены за единицу со скидкой и курсом и ТРИММ с логистикой и курсом
+    не хранятся: правка строки пересчитывает одну цену, смена множителей — одну сумму
+    по столбцу. Суммы ведутся по приращениям и всегда точны.
+    """
+    def __init__(self, discount: float = 0.0, logistics: float = 1.0, kurs: float = 1.0):
+        self.discount = discount     # %
+        self.logistics = logistics
+        self.kurs = kurs
+        self.pns: List[str] = []
+        self.descs: List[str] = []
+        self.qtys = array("q")
+        self.ctrls: List[str] = []
+        self.packs: List[str] = []
+        self.list_prices = array("q")
+        self.trimm_prices = array("q")
+        self.has_list = array("b")
+        self.has_trimm = array("b")
+        self.list_sum = 0     # Σ qty × list price
+        self.sale_sum = 0     # Σ qty × sale price (discount, kurs): «Итого»
+        self.cost_sum = 0     # Σ qty × cost price (TRIMM, logistics, kurs)
+        self._factors = None
+        self._set_factors()
+
+    def __len__(self) -> int:
+        return len(self.pns)
+
+    def _columns(self):
+        return (self.pns, self.descs, self.qtys, self.ctrls, self.packs,
+                self.list_prices, self.trimm_prices, self.has_list, self.has_trimm)
+
+    def _set_factors(self) -> bool:
+        """Множители -> числители дробей со знаменателем FACTOR_ONE²; True, если они изменились."""
+        logistics, kurs = fixed(self.logistics, 4), fixed(self.kurs, 4)
+        factors = ((FACTOR_ONE - fixed(self.discount, 2)) * kurs, logistics * kurs, logistics * FACTOR_ONE)
+        changed = factors != self._factors
+        self._factors = factors
+        return changed
+
+    def _sums(self, qtys, list_prices, trimm_prices) -> Tuple[int, int, int]:
+        """(list, sale, cost) по срезам столбцов."""
+        sale_num, cost_num, _ = self._factors
+        return (sum(map(mul, qtys, list_prices)),
+                sum(map(mul, qtys, scale(list_prices, sale_num, FACTOR_DEN))),
+                sum(map(mul, qtys, scale(trimm_prices, cost_num, FACTOR_DEN))))
+
+    # ---- lines ----
+    def add_lines(self, lines: Iterable[QuoteLine]):
+        start = len(self.pns)
+        for pn, desc, qty, pack, list_price, trimm_price in lines:
+            list_minor, trimm_minor = to_minor(list_price) or 0, to_minor(trimm_price) or 0
+            self.pns.append(pn)
+            self.descs.append(desc)
+            self.qtys.append(qty)
+            self.ctrls.append("1")
+            self.packs.append("" if pack is None else str(pack))
+            self.list_prices.append(list_minor)
+            self.trimm_prices.append(trimm_minor)
+            self.has_list.append(list_price is not None)
+            self.has_trimm.append(trimm_price is not None)
+        list_sum, sale_sum, cost_sum = self._sums(self.qtys[start:], self.list_prices[start:], self.trimm_prices[start:])
+        self.list_sum += list_sum
+        self.sale_sum += sale_sum
+        self.cost_sum += cost_sum
+
+    def remove_range(self, first: int, last: int):
+        """Удалить строки first..last включительно."""
+        part = slice(first, last + 1)
+        list_sum, sale_sum, cost_sum = self._sums(self.qtys[part], self.list_prices[part], self.trimm_prices[part])
+        self.list_sum -= list_sum
+        self.sale_sum -= sale_sum
+        self.cost_sum -= cost_sum
+        for column in self._columns():
+            del column[part]
+
+    def move(self, src: int, dst: int):
+        """Переставить строку src на место перед dst."""
+        for column in self._columns():
+            value = column[src]
+            del column[src]
+            column.insert(dst - 1 if dst > src else dst, value)
+
+    def set_qty(self, row: int, qty: int):
+        sale_num, cost_num, _ = self._factors
+        dqty = qty - self.qtys[row]
+        self.qtys[row] = qty
+        self.list_sum += dqty * self.list_prices[row]
+        self.sale_sum += dqty * scale_one(self.list_prices[row], sale_num, FACTOR_DEN)
+        self.cost_sum += dqty * scale_one(self.trimm_prices[row], cost_num, FACTOR_DEN)
+
+    def clear_pns(self):
+        self.pns = [""] * len(self.pns)
+
+    # ---- prices ----
+    def set_pricing(self, discount: Optional[float] = None, logistics: Optional[float] = None,
+                    kurs: Optional[float] = None):
+        """Сменить скидку/логистику/курс и пересчитать суммы (ничего, если множители те же)."""
+        if discount is not None: self.discount = discount
+        if logistics is not None: self.logistics = logistics
+        if kurs is not None: self.kurs = kurs
+        if self._set_factors():
+            self.recompute_sums()
+
+    def list_price(self, row: int) -> Optional[int]:
+        return self.list_prices[row] if self.has_list[row] else None
+
+    def sale_price(self, row: int) -> Optional[int]:
+        """Цена за единицу в КП: со скидкой, по курсу."""
+        return scale_one(self.list_prices[row], self._factors[0], FACTOR_DEN) if self.has_list[row] else None
+
+    def trimm_price(self, row: int) -> Optional[int]:
+        """Цена ТРИММ строки с логистикой."""
+        return scale_one(self.trimm_prices[row], self._factors[2], FACTOR_DEN) if self.has_trimm[row] else None
+
+    def line_totals(self) -> array:
+        """Сумма каждой строки в КП: кол-во × цена за единицу со скидкой и курсом."""
+        return array("q", map(mul, self.qtys, scale(self.list_prices, self._factors[0], FACTOR_DEN)))
+
+    def full_sums(self) -> Tuple[int, int, int]:
+        """(list, sale, cost) заново по всем строкам."""
+        return self._sums(self.qtys, self.list_prices, self.trimm_prices)
+
+    def recompute_sums(self):
+        self.list_sum, self.sale_sum, self.cost_sum = self.full_sums()
+
+    def check_sums(self):
+        """Для отладки: текущие суммы должны совпадать с полным пересчётом."""
+        running, full = (self.list_sum, self.sale_sum, self.cost_sum), self.full_sums()
+        if running != full:
+            raise AssertionError(f"сумма сводки разошлась: {running!r} != {full!r}")
+
+    def totals(self) -> QuoteTotals:
+        margin = (self.sale_sum - self.cost_sum) / self.cost_sum if self.cost_sum > 0 else None
+        return QuoteTotals(self.list_sum, self.sale_sum, self.cost_sum, margin)
+
+    def export_rows(self) -> List[Tuple[str, str, int, float]]:
+        """(pn, desc, qty, цена) непустых строк — для выгрузки КП."""
+        rows = []
+        for pn, desc, qty, price in zip(self.pns, self.descs, self.qtys, self.list_prices):
+            pn, desc = pn.strip(), desc.strip()
+            if pn or desc or qty or price:
+                rows.append((pn, desc, qty, price / MINOR))
+        return rows